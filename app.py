@@ -1,9 +1,37 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, stream_template, stream_with_context, g, has_request_context
 import boto3
 import os
-import functools
 import logging
 import datetime
+import random
+import bisect
+import threading
+import sys
+import time
+import json
+import uuid
+import fnmatch
+import functools
+import operator
+import weakref
+import sqlite3
+import csv
+import io
+import itertools
+import zlib
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
+from botocore.exceptions import ClientError, HTTPClientError, ConnectionError as BotocoreConnectionError
+
+# Parquet导出为可选功能，需要安装pyarrow
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 app = Flask(__name__)
 
@@ -24,34 +52,350 @@ aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
 aws_session_token = os.getenv('AWS_SESSION_TOKEN')
 aws_region = os.getenv('AWS_DEFAULT_REGION')
 
-logger.info(f"启动应用，使用区域: {aws_region}")
+# StackSet所在的主区域（可指定多个，逗号分隔），默认为AWS_DEFAULT_REGION
+stack_set_regions = [region.strip() for region in os.getenv('STACKSET_REGIONS', aws_region or '').split(',') if region.strip()]
 
-# 创建Boto3客户端
-cloudformation_client = boto3.client(
-    'cloudformation',
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-    aws_session_token=aws_session_token,
-    region_name=aws_region
-)
+# 并发与限流配置
+max_workers = int(os.getenv('STACKSET_MAX_WORKERS', '8'))
+api_rate_limit = float(os.getenv('AWS_API_RATE_LIMIT', '10'))
+api_burst = int(os.getenv('AWS_API_BURST', str(max(1, int(api_rate_limit)))))
+api_max_attempts = int(os.getenv('AWS_API_MAX_ATTEMPTS', '8'))
+aws_max_pool_connections = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', str(max(10, max_workers * 2))))
 
-organizations_client = boto3.client(
-    'organizations',
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-    aws_session_token=aws_session_token,
-    region_name=aws_region
-)
+# StackSet实例缓存配置
+inventory_cache_ttl = int(os.getenv('INVENTORY_CACHE_TTL', '300'))
+inventory_cache_stale_ttl = int(os.getenv('INVENTORY_CACHE_STALE_TTL', '3600'))
+inventory_rescan_interval = int(os.getenv('INVENTORY_RESCAN_INTERVAL', '3600'))
+inventory_cache_max_entries = int(os.getenv('INVENTORY_CACHE_MAX_ENTRIES', '128'))
+inventory_cache_max_mb = int(os.getenv('INVENTORY_CACHE_MAX_MB', '512'))
+account_directory_ttl = int(os.getenv('ACCOUNT_DIRECTORY_TTL', '300'))
+organization_tree_ttl = int(os.getenv('ORGANIZATION_TREE_TTL', '3600'))
+
+# 快照存储配置，需要显式设置SNAPSHOT_DB_PATH（例如stackset_snapshots.db）才保存快照，
+# 避免cli.py、bench.py等导入app时在当前目录创建数据库
+snapshot_db_path = os.getenv('SNAPSHOT_DB_PATH', '')
+snapshot_interval = int(os.getenv('SNAPSHOT_INTERVAL', '3600'))
+snapshot_retention_days = int(os.getenv('SNAPSHOT_RETENTION_DAYS', '7'))
+
+# 主页流式渲染配置
+dashboard_streaming = os.getenv('DASHBOARD_STREAMING', 'true').lower() == 'true'
+
+# StackSet操作配置
+operation_max_accounts = int(os.getenv('OPERATION_MAX_ACCOUNTS', '100'))
+operation_max_concurrent_percentage = int(os.getenv('OPERATION_MAX_CONCURRENT_PERCENTAGE', '100'))
+operation_failure_tolerance_percentage = int(os.getenv('OPERATION_FAILURE_TOLERANCE_PERCENTAGE', '10'))
+operation_region_concurrency_type = os.getenv('OPERATION_REGION_CONCURRENCY_TYPE', 'PARALLEL')
+operation_poll_interval = int(os.getenv('OPERATION_POLL_INTERVAL', '10'))
+operation_timeout = int(os.getenv('OPERATION_TIMEOUT', '3600'))
+
+# 后台任务配置
+job_max_workers = int(os.getenv('JOB_MAX_WORKERS', '4'))
+job_retention = int(os.getenv('JOB_RETENTION', '86400'))
+
+# 漂移检测配置：同时进行漂移检测的StackSet数量
+drift_detection_concurrency = int(os.getenv('DRIFT_DETECTION_CONCURRENCY', '5'))
+
+logger.info(f"启动应用，使用区域: {aws_region}, StackSet主区域: {stack_set_regions}, 并发数: {max_workers}, API速率: {api_rate_limit}/s")
+
+# 延迟直方图的桶边界（秒）
+METRIC_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRIC_DESCRIPTIONS = {
+    'aws_api_calls_total': ('counter', 'AWS API calls, one per page for paginated operations.'),
+    'aws_api_errors_total': ('counter', 'AWS API calls that returned an error.'),
+    'aws_api_throttles_total': ('counter', 'AWS API attempts that were throttled, including attempts that were retried.'),
+    'aws_api_retries_total': ('counter', 'AWS API retries by the application backoff.'),
+    'aws_api_result_items_total': ('counter', 'Items returned by AWS List operations.'),
+    'aws_api_call_duration_seconds': ('histogram', 'AWS API call latency of one HTTP attempt; each call_aws retry is observed separately.'),
+    'aws_api_rate_limit_wait_seconds': ('histogram', 'Time spent waiting for the client-side token bucket.'),
+    'http_requests_total': ('counter', 'HTTP requests handled.'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request duration until the response body was fully sent.'),
+    'singleflight_shared_total': ('counter', 'Loads that waited for an identical in-flight load instead of calling AWS.'),
+    'inventory_incremental_updates_total': ('counter', 'Inventory refreshes after StackSet operations, applied from operation results, superseded by a newer scan or left to a full rescan.'),
+    'inventory_cache_entries': ('gauge', 'Entries in each cache.'),
+    'inventory_cache_bytes': ('gauge', 'Estimated memory used by each cache.'),
+    'aws_api_rate_limit': ('gauge', 'Current token bucket rate in requests per second.'),
+    'jobs': ('gauge', 'Background jobs by status.'),
+}
+
+class Metrics:
+    # 进程内指标：计数器和直方图按 (名称, 标签) 累计，/metrics 以Prometheus文本格式输出
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, labels, value=1):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+    def render(self, gauges=()):
+        # gauges为抓取时计算的 (名称, 标签, 值) 列表
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append(f'{name}{self._format_labels(labels)} {value}')
+            for (name, labels), histogram in self.histograms.items():
+                lines = samples.setdefault(name, [])
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f'{name}_bucket{self._format_labels(labels + (("le", str(bound)),))} {count}')
+                lines.append(f'{name}_bucket{self._format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+                lines.append(f'{name}_sum{self._format_labels(labels)} {histogram["sum"]:.6f}')
+                lines.append(f'{name}_count{self._format_labels(labels)} {histogram["count"]}')
+        for name, labels, value in gauges:
+            samples.setdefault(name, []).append(f'{name}{self._format_labels(tuple(sorted(labels.items())))} {value}')
+        output = []
+        for name in sorted(samples):
+            metric_type, help_text = METRIC_DESCRIPTIONS.get(name, ('untyped', name))
+            output.append(f'# HELP {name} {help_text}')
+            output.append(f'# TYPE {name} {metric_type}')
+            output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+
+metrics = Metrics(METRIC_BUCKETS)
+
+def register_client_metrics(client, service_name, region_name):
+    # 通过botocore事件记录每个操作的调用次数、延迟、重试和限流
+    def before_call(context, **kwargs):
+        context['metrics_started_at'] = time.perf_counter()
+
+    def after_call(model, parsed, context, **kwargs):
+        labels = {'service': service_name, 'region': region_name, 'operation': model.name}
+        metrics.inc('aws_api_calls_total', labels)
+        if 'metrics_started_at' in context:
+            metrics.observe('aws_api_call_duration_seconds', labels, time.perf_counter() - context['metrics_started_at'])
+        error_code = parsed.get('Error', {}).get('Code')
+        if error_code:
+            metrics.inc('aws_api_errors_total', dict(labels, code=error_code))
+        elif model.name.startswith('List'):
+            items = sum(len(value) for key, value in parsed.items() if isinstance(value, list))
+            metrics.inc('aws_api_result_items_total', labels, items)
+
+    def needs_retry(response, operation, **kwargs):
+        # 每次HTTP尝试结束后触发，无论之后是否重试，限流按尝试次数计数；返回None不影响重试判断
+        if response and response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+            metrics.inc('aws_api_throttles_total', {'service': service_name, 'region': region_name, 'operation': operation.name})
+
+    def after_call_error(exception, context, event_name, **kwargs):
+        labels = {'service': service_name, 'region': region_name, 'operation': event_name.rsplit('.', 1)[-1]}
+        metrics.inc('aws_api_calls_total', labels)
+        metrics.inc('aws_api_errors_total', dict(labels, code=type(exception).__name__))
 
-def get_organization_accounts():
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('needs-retry', needs_retry)
+    client.meta.events.register('after-call-error', after_call_error)
+
+@contextmanager
+def server_timing(name):
+    # 记录请求内某个阶段的耗时，非流式响应通过Server-Timing头返回
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.setdefault('server_timing', []).append((name, time.perf_counter() - started_at))
+
+class ClientPool:
+    # 按 (服务, 区域) 复用Boto3客户端；客户端是线程安全的，并发调用共享连接池
+    def __init__(self, config):
+        self.session = boto3.session.Session(
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            aws_session_token=aws_session_token,
+            region_name=aws_region
+        )
+        self.config = config
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get(self, service_name, region_name=None):
+        key = (service_name, region_name or aws_region)
+        client = self.clients.get(key)
+        if client is None:
+            # Session不是线程安全的，创建客户端时加锁
+            with self.lock:
+                client = self.clients.get(key)
+                if client is None:
+                    logger.info(f"创建Boto3客户端: {service_name} ({key[1]})")
+                    client = self.session.client(service_name, region_name=key[1], config=self.config)
+                    register_client_metrics(client, service_name, key[1])
+                    self.clients[key] = client
+        return client
+
+# 重试只由call_aws负责（限流时同时降低令牌桶速率），关闭botocore自身的重试和客户端限速，避免两层重试叠加
+client_pool = ClientPool(Config(
+    max_pool_connections=aws_max_pool_connections,
+    retries={'mode': 'standard', 'total_max_attempts': 1}
+))
+
+def get_cloudformation_client(region_name=None):
+    return client_pool.get('cloudformation', region_name)
+
+def get_organizations_client():
+    return client_pool.get('organizations')
+
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+}
+
+# 可重试的临时错误：服务端5xx、超时和连接错误，重试时不降低令牌桶速率
+TRANSIENT_ERROR_CODES = {
+    'InternalFailure',
+    'InternalError',
+    'ServiceUnavailable',
+    'RequestTimeout',
+    'RequestTimeoutException',
+}
+
+def is_transient_error(error):
+    if isinstance(error, (BotocoreConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        return (error.response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES
+                or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500)
+    return False
+
+class TokenBucket:
+    # 所有工作线程共享的令牌桶；遇到限流时降低速率，成功后逐步恢复
+    def __init__(self, rate, capacity, min_rate=0.5):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            logger.warning(f"API被限流，降低请求速率至 {self.rate:.2f}/s")
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+token_buckets = {}
+token_buckets_lock = threading.Lock()
+
+def get_token_bucket(operation):
+    # API配额按服务和区域计算，每个 (服务, 区域) 使用独立的令牌桶
+    meta = getattr(getattr(operation, '__self__', None), 'meta', None)
+    key = (meta.service_model.service_name, meta.region_name) if meta else None
+    with token_buckets_lock:
+        if key not in token_buckets:
+            token_buckets[key] = TokenBucket(api_rate_limit, api_burst)
+        return token_buckets[key]
+
+def call_aws(operation, **kwargs):
+    # 通过共享令牌桶调用AWS API，遇到限流或临时错误时使用带抖动的指数退避重试
+    api_token_bucket = get_token_bucket(operation)
+    meta = getattr(getattr(operation, '__self__', None), 'meta', None)
+    labels = {'service': meta.service_model.service_name, 'region': meta.region_name} if meta else {'service': 'unknown', 'region': 'unknown'}
+    attempt = 0
+    while True:
+        started_at = time.perf_counter()
+        api_token_bucket.acquire()
+        metrics.observe('aws_api_rate_limit_wait_seconds', labels, time.perf_counter() - started_at)
+        try:
+            response = operation(**kwargs)
+            api_token_bucket.on_success()
+            return response
+        except (ClientError, BotocoreConnectionError, HTTPClientError) as e:
+            error_code = e.response.get('Error', {}).get('Code') if isinstance(e, ClientError) else type(e).__name__
+            throttled = error_code in THROTTLING_ERROR_CODES
+            attempt += 1
+            if not (throttled or is_transient_error(e)) or attempt >= api_max_attempts:
+                raise
+            if throttled:
+                api_token_bucket.on_throttle()
+            operation_name = getattr(operation, '__name__', 'unknown')
+            operation_name = getattr(meta, 'method_to_api_mapping', {}).get(operation_name, operation_name)
+            metrics.inc('aws_api_retries_total', dict(labels, operation=operation_name, source='application'))
+            backoff = random.uniform(0, min(20.0, 0.5 * 2 ** attempt))
+            logger.warning(f"{getattr(operation, '__name__', 'AWS API')} {'被限流' if throttled else '临时错误'} ({error_code})，"
+                           f"第 {attempt} 次重试，等待 {backoff:.2f}s")
+            time.sleep(backoff)
+
+def fetch_organization_accounts():
     logger.info("获取组织账户列表")
-    accounts = []
-    paginator = organizations_client.get_paginator('list_accounts')
-    for page in paginator.paginate():
-        accounts.extend(page['Accounts'])
+    accounts = list_all(get_organizations_client().list_accounts, 'Accounts')
     logger.info(f"获取到 {len(accounts)} 个组织账户")
     return accounts
 
+@app.route('/get_organization_tree', methods=['GET'])
+def get_organization_tree():
+    try:
+        logger.info("处理请求: 获取组织OU层级")
+        return jsonify(get_organization_model().to_dict())
+    except Exception as e:
+        logger.error(f"获取组织OU层级时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+
+@app.route('/refresh_organization', methods=['POST'])
+def refresh_organization():
+    data = request.get_json(silent=True) or {}
+    full = data.get('full', False)
+    
+    logger.info(f"处理请求: 刷新组织模型, 完整重建: {full}")
+    
+    try:
+        if full:
+            organization_cache.invalidate('organization')
+        organization_model = get_organization_model(force_refresh=True)
+        logger.info(f"组织模型已刷新: {len(organization_model.accounts)} 个账户, {len(organization_model.organizational_units)} 个OU")
+        return jsonify({'message': 'Organization refreshed.', **organization_model.to_dict()})
+    except Exception as e:
+        logger.error(f"刷新组织模型时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+
 @app.route('/get_organization_accounts', methods=['GET'])
 def get_organization_accounts_route():
     try:
@@ -64,227 +408,1827 @@ def get_organization_accounts_route():
         logger.error(f"获取组织账户时出错: {str(e)}", exc_info=True)
         return jsonify({'message': str(e)}), 500
 
-@functools.lru_cache(maxsize=128)
-def get_stack_instances(stack_set_name):
-    logger.info(f"获取StackSet实例: {stack_set_name}")
-    instances = []
+def stack_set_key(stack_set_name, stack_set_region=None):
+    # 不同主区域中可能存在同名StackSet，缓存和任务均以 (区域, 名称) 标识
+    return (stack_set_region or aws_region, stack_set_name)
+
+def fetch_stack_instances(stack_set_name, stack_set_region=None, filters=None):
+    # filters为list_stack_instances的Filters参数，由服务端过滤，只返回匹配的实例
+    logger.info(f"获取StackSet实例: {stack_set_name} ({stack_set_region or aws_region}), 服务端过滤: {filters or '无'}")
+    request_args = {'StackSetName': stack_set_name, 'CallAs': 'DELEGATED_ADMIN', 'MaxResults': 100}
+    if filters:
+        request_args['Filters'] = filters
+    # 逐页转换为精简记录，不保留原始响应
+    instances = list_all(get_cloudformation_client(stack_set_region).list_stack_instances, 'Summaries', convert=instance_record, **request_args)
+    logger.info(f"获取到 {len(instances)} 个StackSet实例")
+    return instances
+
+def instance_record(summary):
+    # 只保留索引、页面和快照用到的字段
+    return {
+        'Account': summary['Account'],
+        'Region': summary['Region'],
+        'OrganizationalUnitId': summary.get('OrganizationalUnitId'),
+        'DetailedStatus': summary.get('StackInstanceStatus', {}).get('DetailedStatus'),
+        'DriftStatus': summary.get('DriftStatus'),
+    }
+
+class InstanceIndex:
+    # 列式存储：每个维度保存一张取值表（字符串经sys.intern驻留）和按实例位置排列的编码数组，
+    # 并按取值记录位置数组和计数。每个实例只占几十字节，记录在查询时按需组装
+    FIELDS = {
+        'account': 'Account',
+        'region': 'Region',
+        'ou': 'OrganizationalUnitId',
+        'status': 'DetailedStatus',
+        'drift': 'DriftStatus',
+    }
+
+    def __init__(self, records, age=0):
+        # 最近一次全量扫描的时间：从快照加载时为快照的获取时间，增量更新生成的索引沿用原值
+        self.scanned_at = time.monotonic() - age
+        self.values = {field: [] for field in self.FIELDS}
+        self.codes = {field: {} for field in self.FIELDS}
+        self.columns = {field: array('I') for field in self.FIELDS}
+        for record in records:
+            for field, name in self.FIELDS.items():
+                self.columns[field].append(self._encode(field, record.get(name)))
+        self.buckets = {}
+        for field, column in self.columns.items():
+            positions = [array('I') for _ in self.values[field]]
+            for position, code in enumerate(column):
+                positions[code].append(position)
+            self.buckets[field] = dict(zip(self.values[field], positions))
+        self.counts = {field: {value: len(positions) for value, positions in buckets.items()}
+                       for field, buckets in self.buckets.items()}
+        # 区域组合相同的账户共享同一个frozenset
+        region_sets = {}
+        regions, region_column = self.values['region'], self.columns['region']
+        self.account_regions = {}
+        for account, positions in self.buckets['account'].items():
+            account_regions = frozenset(regions[region_column[position]] for position in positions)
+            self.account_regions[account] = region_sets.setdefault(account_regions, account_regions)
+
+    def _encode(self, field, value):
+        codes = self.codes[field]
+        code = codes.get(value)
+        if code is None:
+            if isinstance(value, str):
+                value = sys.intern(value)
+            code = codes[value] = len(self.values[field])
+            self.values[field].append(value)
+        return code
+
+    def __len__(self):
+        return len(self.columns['account'])
+
+    def record(self, position):
+        return {name: self.values[field][self.columns[field][position]] for field, name in self.FIELDS.items()}
+
+    def records(self):
+        return (self.record(position) for position in range(len(self)))
+
+    def _position(self, account_id, region):
+        region_code = self.codes['region'].get(region)
+        region_column = self.columns['region']
+        for position in self.buckets['account'].get(account_id, ()):
+            if region_column[position] == region_code:
+                return position
+        return None
+
+    def get(self, account_id, region):
+        position = self._position(account_id, region)
+        return None if position is None else self.record(position)
+
+    def with_changes(self, changes):
+        # changes为 {(账户, 区域): 记录}，记录为None表示删除；返回新的索引，原索引不变（可能仍有请求在读取）。
+        # 编码数组整体复制，只修改变化的位置；位置数组在第一次修改时复制，耗时与变化规模相关
+        index = object.__new__(InstanceIndex)
+        index.scanned_at = self.scanned_at
+        index.values = {field: list(values) for field, values in self.values.items()}
+        index.codes = {field: dict(codes) for field, codes in self.codes.items()}
+        index.columns = {field: column[:] for field, column in self.columns.items()}
+        index.buckets = {field: dict(buckets) for field, buckets in self.buckets.items()}
+        index.counts = {field: dict(counts) for field, counts in self.counts.items()}
+        copied = set()
+        accounts = set()
+        for (account_id, region), record in changes.items():
+            position = index._position(account_id, region)
+            accounts.add(account_id)
+            if record is None:
+                if position is not None:
+                    index._remove(position, copied)
+            elif position is None:
+                position = len(index)
+                for field, name in self.FIELDS.items():
+                    index.columns[field].append(index._encode(field, record.get(name)))
+                index._link(position, copied)
+            else:
+                index._unlink(position, copied)
+                for field, name in self.FIELDS.items():
+                    index.columns[field][position] = index._encode(field, record.get(name))
+                index._link(position, copied)
+        # 只重新计算变化账户的区域集合，仍与其他账户共享相同的frozenset
+        region_sets = {regions: regions for regions in self.account_regions.values()}
+        index.account_regions = dict(self.account_regions)
+        regions, region_column = index.values['region'], index.columns['region']
+        for account_id in accounts:
+            positions = index.buckets['account'].get(account_id)
+            if positions:
+                account_regions = frozenset(regions[region_column[position]] for position in positions)
+                index.account_regions[account_id] = region_sets.setdefault(account_regions, account_regions)
+            else:
+                index.account_regions.pop(account_id, None)
+        return index
+
+    def _bucket(self, field, value, copied):
+        # 位置数组与原索引共享，修改前复制一次
+        if (field, value) not in copied:
+            copied.add((field, value))
+            self.buckets[field][value] = array('I', self.buckets[field].get(value, ()))
+        return self.buckets[field][value]
+
+    def _link(self, position, copied):
+        for field, column in self.columns.items():
+            value = self.values[field][column[position]]
+            bisect.insort(self._bucket(field, value, copied), position)
+            self.counts[field][value] = self.counts[field].get(value, 0) + 1
+
+    def _unlink(self, position, copied):
+        # 没有剩余位置的取值从位置数组和计数中移除，编码保留
+        for field, column in self.columns.items():
+            value = self.values[field][column[position]]
+            positions = self._bucket(field, value, copied)
+            del positions[bisect.bisect_left(positions, position)]
+            self.counts[field][value] -= 1
+            if not positions:
+                del self.buckets[field][value], self.counts[field][value]
+                copied.discard((field, value))
+
+    def _remove(self, position, copied):
+        # 用最后一个实例填补被删除的位置，只影响这两个位置
+        last = len(self) - 1
+        self._unlink(position, copied)
+        if position != last:
+            self._unlink(last, copied)
+            for column in self.columns.values():
+                column[position] = column[last]
+            self._link(position, copied)
+        for column in self.columns.values():
+            column.pop()
+
+    def count(self, field, value):
+        return self.counts[field].get(value, 0)
+
+    def query(self, ignore_accounts=(), **filters):
+        # 从候选最少的过滤条件出发，其余条件按编码逐条校验，复杂度与结果规模相关而非实例总数
+        filters = {field: set(values) for field, values in filters.items() if values}
+        for field in filters:
+            if field not in self.FIELDS:
+                raise ValueError(f"Unsupported filter: {field}")
+        if not filters:
+            candidates = range(len(self))
+        else:
+            # 按预先统计的数量选择驱动条件，只展开该条件的位置数组
+            driving_field = min(filters, key=lambda field: sum(self.count(field, value) for value in filters[field]))
+            candidates = sorted(position for value in filters.pop(driving_field) for position in self.buckets[driving_field].get(value, ()))
+        code_filters = [(self.columns[field], {self.codes[field][value] for value in values if value in self.codes[field]})
+                        for field, values in filters.items()]
+        ignored_codes = {self.codes['account'][account] for account in ignore_accounts if account in self.codes['account']}
+        account_column = self.columns['account']
+        for position in candidates:
+            if account_column[position] in ignored_codes:
+                continue
+            if all(column[position] in codes for column, codes in code_filters):
+                yield self.record(position)
+
+def estimate_size(value, sample_size=20):
+    # 抽样估算缓存条目占用的内存，避免对大列表做完整的深度遍历
+    def deep_size(obj):
+        size = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            size += sum(deep_size(k) + deep_size(v) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple, set)):
+            size += sum(deep_size(item) for item in obj)
+        return size
+
+    if isinstance(value, InstanceIndex):
+        # 编码数组和位置数组占主要部分；取值表、编码表和账户区域表按条目数估算
+        arrays = [*value.columns.values(), *(positions for buckets in value.buckets.values() for positions in buckets.values())]
+        distinct_values = sum(len(values) for values in value.values.values())
+        return sum(sys.getsizeof(positions) for positions in arrays) + deep_size(value.values) + (distinct_values + len(value.account_regions)) * 100
+    if hasattr(value, '__dict__'):
+        return sys.getsizeof(value) + deep_size(vars(value))
+    if isinstance(value, list) and len(value) > sample_size:
+        sample = value[:sample_size]
+        return sys.getsizeof(value) + sum(deep_size(item) for item in sample) * len(value) // sample_size
+    return deep_size(value)
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight:
+    # 合并相同key的并发加载：第一个调用者执行加载，其余调用者等待并共享其结果或异常
+    def __init__(self, name):
+        self.name = name
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            metrics.inc('singleflight_shared_total', {'flight': self.name})
+            logger.info(f"等待进行中的加载: {self.name} {key}")
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = func()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+class CacheEntry:
+    def __init__(self, value, size, generation):
+        self.value = value
+        self.size = size
+        self.generation = generation
+        self.fetched_at = time.monotonic()
+
+class InventoryCache:
+    # 按StackSet缓存实例列表：TTL内直接返回；过期但未超过stale期限时返回旧数据并在后台刷新；
+    # 同时限制条目数量和估算内存，超出时按LRU淘汰；同一条目的并发加载合并为一次
+    def __init__(self, name, loader, ttl, stale_ttl, max_entries, max_bytes, executor, on_store=None):
+        self.name = name
+        self.loader = loader
+        self.flights = SingleFlight(name)
+        self.on_store = on_store
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.executor = executor
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.refreshing = set()
+        self.total_size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, force_refresh=False):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and not force_refresh:
+                age = time.monotonic() - entry.fetched_at
+                if age < self.ttl:
+                    self.entries.move_to_end(key)
+                    return entry.value
+                if age < self.ttl + self.stale_ttl:
+                    self.entries.move_to_end(key)
+                    if key not in self.refreshing:
+                        self.refreshing.add(key)
+                        logger.info(f"缓存已过期，后台刷新: {key}")
+                        self.executor.submit(self._refresh, key)
+                    return entry.value
+            generation = self.generations.get(key, 0)
+        return self._load(key, generation)
+
+    def _load(self, key, generation):
+        # 按 (key, generation) 合并：失效之后的请求不会共享失效之前开始的加载
+        def load():
+            value = self.loader(key)
+            self._store(key, value, generation)
+            return value
+        return self.flights.do((key, generation), load)
+
+    def generation(self, key):
+        with self.lock:
+            return self.generations.get(key, 0)
+
+    def replace(self, key, expected, value):
+        # 当前条目仍为expected时替换为value并递增generation，丢弃进行中的旧加载结果；否则返回False
+        size = estimate_size(value)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.value is not expected:
+                return False
+            self.generations[key] = self.generations.get(key, 0) + 1
+            self._insert(key, value, size, self.generations[key])
+        if self.on_store:
+            self.on_store(key, value)
+        return True
+
+    def peek(self, key):
+        # 返回当前缓存值（可能已过期），不触发加载
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry.value if entry else None
+
+    def _refresh(self, key):
+        try:
+            with self.lock:
+                generation = self.generations.get(key, 0)
+            self._load(key, generation)
+        except Exception as e:
+            logger.error(f"后台刷新缓存失败: {key}: {str(e)}", exc_info=True)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def _store(self, key, value, generation):
+        size = estimate_size(value)
+        with self.lock:
+            # 加载期间条目被失效时丢弃结果，避免用变更前的数据覆盖
+            if self.generations.get(key, 0) != generation:
+                logger.info(f"缓存条目在加载期间已失效，丢弃结果: {key}")
+                return
+            self._insert(key, value, size, generation)
+        if self.on_store:
+            self.on_store(key, value)
+
+    def seed(self, key, value, age):
+        # 用快照预热缓存：条目按已过期处理，首次访问时立即返回并在后台刷新
+        size = estimate_size(value)
+        with self.lock:
+            if key in self.entries:
+                return
+            self._insert(key, value, size, self.generations.get(key, 0))
+            self.entries[key].fetched_at = time.monotonic() - max(self.ttl, min(age, self.ttl + self.stale_ttl - 1))
+
+    def _insert(self, key, value, size, generation):
+        self._remove(key)
+        self.entries[key] = CacheEntry(value, size, generation)
+        self.total_size += size
+        while self.entries and (len(self.entries) > self.max_entries or self.total_size > self.max_bytes):
+            evicted_key = next(iter(self.entries))
+            if evicted_key == key and len(self.entries) == 1:
+                break
+            self._remove(evicted_key)
+            logger.info(f"缓存超出限制，淘汰: {evicted_key}")
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.total_size -= entry.size
+
+    def invalidate(self, key):
+        with self.lock:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            self._remove(key)
+        logger.info(f"缓存已失效: {key}")
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self.generations[key] = self.generations.get(key, 0) + 1
+            self.entries.clear()
+            self.total_size = 0
+
+class SnapshotStore:
+    # 将StackSet详情、实例列表和组织模型保存到SQLite：启动时用最近的快照预热缓存，
+    # 保留的历史快照用于对比变化。同一对象自快照创建起SNAPSHOT_INTERVAL内只保留一个快照（覆盖更新）
+    def __init__(self, path, interval, retention):
+        self.interval = interval
+        self.retention = retention
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA foreign_keys=ON;
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    region TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    data TEXT
+                );
+                CREATE INDEX IF NOT EXISTS snapshots_key ON snapshots (kind, region, name, fetched_at);
+                CREATE TABLE IF NOT EXISTS instances (
+                    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+                    account TEXT NOT NULL,
+                    region TEXT NOT NULL,
+                    ou TEXT,
+                    status TEXT,
+                    drift TEXT
+                );
+                CREATE INDEX IF NOT EXISTS instances_snapshot ON instances (snapshot_id);
+            """)
+
+    def save(self, kind, key, value, fetched_at):
+        # kind为instances时value为实例列表，逐行保存；其他类型以JSON保存
+        region, name = key
+        data = None if kind == 'instances' else json.dumps(value, default=str)
+        with self.lock, self.connection:
+            latest = self.connection.execute(
+                'SELECT id, created_at FROM snapshots WHERE kind = ? AND region = ? AND name = ? ORDER BY fetched_at DESC LIMIT 1',
+                (kind, region, name)).fetchone()
+            # 以快照的创建时间判断间隔，覆盖更新不会推迟下一个快照
+            if latest and fetched_at - latest[1] < self.interval:
+                snapshot_id = latest[0]
+                self.connection.execute('UPDATE snapshots SET fetched_at = ?, data = ? WHERE id = ?', (fetched_at, data, snapshot_id))
+                self.connection.execute('DELETE FROM instances WHERE snapshot_id = ?', (snapshot_id,))
+            else:
+                snapshot_id = self.connection.execute(
+                    'INSERT INTO snapshots (kind, region, name, created_at, fetched_at, data) VALUES (?, ?, ?, ?, ?, ?)',
+                    (kind, region, name, fetched_at, fetched_at, data)).lastrowid
+            if kind == 'instances':
+                self.connection.executemany(
+                    'INSERT INTO instances (snapshot_id, account, region, ou, status, drift) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(snapshot_id, instance['Account'], instance['Region'], instance['OrganizationalUnitId'],
+                      instance['DetailedStatus'], instance['DriftStatus'])
+                     for instance in value])
+            self.connection.execute(
+                'DELETE FROM snapshots WHERE fetched_at < ? AND id NOT IN (SELECT MAX(id) FROM snapshots GROUP BY kind, region, name)',
+                (time.time() - self.retention,))
+
+    def load_latest(self, kind):
+        # 返回每个对象最近的快照: [(key, value, fetched_at)]
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, region, name, fetched_at, data FROM snapshots s WHERE kind = ? AND id = '
+                '(SELECT id FROM snapshots WHERE kind = s.kind AND region = s.region AND name = s.name ORDER BY fetched_at DESC LIMIT 1) '
+                'ORDER BY fetched_at', (kind,)).fetchall()
+            snapshots = []
+            for snapshot_id, region, name, fetched_at, data in rows:
+                if kind == 'instances':
+                    value = [{'Account': row[0], 'Region': row[1], 'OrganizationalUnitId': row[2], 'DetailedStatus': row[3], 'DriftStatus': row[4]}
+                             for row in self.connection.execute(
+                                 'SELECT account, region, ou, status, drift FROM instances WHERE snapshot_id = ?', (snapshot_id,))]
+                else:
+                    value = json.loads(data)
+                snapshots.append(((region, name), value, fetched_at))
+        return snapshots
+
+    def list_snapshots(self, kind, key):
+        region, name = key
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT s.id, s.fetched_at, COUNT(i.snapshot_id) FROM snapshots s LEFT JOIN instances i ON i.snapshot_id = s.id '
+                'WHERE s.kind = ? AND s.region = ? AND s.name = ? GROUP BY s.id ORDER BY s.fetched_at DESC',
+                (kind, region, name)).fetchall()
+        return [{'SnapshotId': snapshot_id, 'FetchedAt': datetime.datetime.fromtimestamp(fetched_at).isoformat(), 'TotalInstances': total}
+                for snapshot_id, fetched_at, total in rows]
+
+    def diff_instances(self, key, since):
+        # 对比最近的快照与since时间点（或之前最近）的快照，按 (账户, 区域) 找出变化的实例
+        region, name = key
+        with self.lock:
+            snapshots = self.connection.execute(
+                "SELECT id, fetched_at FROM snapshots WHERE kind = 'instances' AND region = ? AND name = ? ORDER BY fetched_at",
+                (region, name)).fetchall()
+            if not snapshots:
+                return None
+            base = next((snapshot for snapshot in reversed(snapshots) if snapshot[1] <= since), snapshots[0])
+            latest = snapshots[-1]
+            query = 'SELECT account, region, ou, status, drift FROM instances WHERE snapshot_id = ?'
+            before = {(row[0], row[1]): row for row in self.connection.execute(query, (base[0],))}
+            after = {(row[0], row[1]): row for row in self.connection.execute(query, (latest[0],))}
+
+        def describe(row, previous=None):
+            instance = {'Account': row[0], 'Region': row[1], 'OrganizationalUnitId': row[2], 'DetailedStatus': row[3], 'DriftStatus': row[4]}
+            if previous:
+                instance.update({'PreviousDetailedStatus': previous[3], 'PreviousDriftStatus': previous[4]})
+            return instance
+
+        changes = {'NewFailed': [], 'NewlyDrifted': [], 'StatusChanged': [], 'Added': [], 'Removed': []}
+        for instance_key, row in after.items():
+            previous = before.get(instance_key)
+            if previous is None:
+                changes['Added'].append(describe(row))
+            elif previous[3:] != row[3:]:
+                changes['StatusChanged'].append(describe(row, previous))
+            if row[3] == 'FAILED' and (previous is None or previous[3] != 'FAILED'):
+                changes['NewFailed'].append(describe(row, previous))
+            if row[4] == 'DRIFTED' and (previous is None or previous[4] != 'DRIFTED'):
+                changes['NewlyDrifted'].append(describe(row, previous))
+        changes['Removed'] = [describe(row) for instance_key, row in before.items() if instance_key not in after]
+        changes['From'] = datetime.datetime.fromtimestamp(base[1]).isoformat()
+        changes['To'] = datetime.datetime.fromtimestamp(latest[1]).isoformat()
+        return changes
+
+def open_snapshot_store():
+    if not snapshot_db_path:
+        return None
+    try:
+        return SnapshotStore(snapshot_db_path, snapshot_interval, snapshot_retention_days * 86400)
+    except Exception as e:
+        logger.error(f"无法打开快照数据库 {snapshot_db_path}，不保存快照: {str(e)}", exc_info=True)
+        return None
+
+snapshot_store = open_snapshot_store()
+# 单线程写入快照，避免阻塞请求和后台刷新
+snapshot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot')
+
+def save_snapshot(kind, key, value):
+    def save():
+        try:
+            snapshot_store.save(kind, key, value, time.time())
+        except Exception as e:
+            logger.error(f"保存快照失败: {kind} {key}: {str(e)}", exc_info=True)
+    if snapshot_store:
+        snapshot_executor.submit(save)
+
+cache_refresh_executor = ThreadPoolExecutor(max_workers=max(1, max_workers // 2), thread_name_prefix='cache-refresh')
+
+def load_instance_index(key):
+    stack_set_region, stack_set_name = key
+    return InstanceIndex(fetch_stack_instances(stack_set_name, stack_set_region))
+
+inventory_cache = InventoryCache(
+    'inventory',
+    load_instance_index,
+    ttl=inventory_cache_ttl,
+    stale_ttl=inventory_cache_stale_ttl,
+    max_entries=inventory_cache_max_entries,
+    max_bytes=inventory_cache_max_mb * 1024 * 1024,
+    executor=cache_refresh_executor,
+    on_store=lambda key, index: save_snapshot('instances', key, index.records())
+)
+
+def fetch_stack_set(key):
+    stack_set_region, stack_set_name = key
+    logger.info(f"获取StackSet详情: {stack_set_name} ({stack_set_region})")
+    return call_aws(get_cloudformation_client(stack_set_region).describe_stack_set, StackSetName=stack_set_name, CallAs='DELEGATED_ADMIN')['StackSet']
+
+stack_set_cache = InventoryCache(
+    'stack_set',
+    fetch_stack_set,
+    ttl=inventory_cache_ttl,
+    stale_ttl=inventory_cache_stale_ttl,
+    max_entries=inventory_cache_max_entries,
+    max_bytes=inventory_cache_max_mb * 1024 * 1024,
+    executor=cache_refresh_executor,
+    on_store=lambda key, stack_set: save_snapshot('stack_set', key, stack_set)
+)
+
+def list_all(operation, result_key, convert=None, **kwargs):
+    # 通用分页：依次请求所有页面并合并result_key对应的列表；convert逐页转换条目，不保留原始响应
+    items = []
     next_token = None
     while True:
         if next_token:
-            stack_instance_details = cloudformation_client.list_stack_instances(StackSetName=stack_set_name, CallAs='DELEGATED_ADMIN', NextToken=next_token)
+            response = call_aws(operation, NextToken=next_token, **kwargs)
         else:
-            stack_instance_details = cloudformation_client.list_stack_instances(StackSetName=stack_set_name, CallAs='DELEGATED_ADMIN')
-        
-        instances.extend(stack_instance_details.get('Summaries', []))
-        next_token = stack_instance_details.get('NextToken')
+            response = call_aws(operation, **kwargs)
+        page_items = response.get(result_key, [])
+        items.extend(map(convert, page_items) if convert else page_items)
+        next_token = response.get('NextToken')
         if not next_token:
-            break
-    logger.info(f"获取到 {len(instances)} 个StackSet实例")
-    return instances
+            return items
 
-@app.route('/')
-def list_stacksets():
+class OrganizationModel:
+    # 组织模型快照：账户目录、根、OU层级以及账户所在的父级OU
+    def __init__(self, accounts, roots, organizational_units, account_parents, tree_fetched_at):
+        self.accounts = accounts
+        self.roots = roots
+        self.organizational_units = organizational_units
+        self.account_parents = account_parents
+        self.tree_fetched_at = tree_fetched_at
+        self.fetched_at = time.monotonic()
+
+    @property
+    def root_id(self):
+        return self.roots[0]['Id']
+
+    def get_parent_id(self, account_id):
+        return self.account_parents.get(account_id, self.root_id)
+
+    def get_ou_path(self, ou_id):
+        # 从根到指定OU的路径
+        path = []
+        while ou_id in self.organizational_units:
+            path.append(self.organizational_units[ou_id])
+            ou_id = self.organizational_units[ou_id]['ParentId']
+        return list(reversed(path))
+
+    def to_snapshot(self):
+        # 单调时钟无法跨进程使用，快照中记录OU层级获取时的系统时间
+        return {
+            'Accounts': list(self.accounts.values()),
+            'Roots': self.roots,
+            'OrganizationalUnits': self.organizational_units,
+            'AccountParents': self.account_parents,
+            'TreeFetchedAt': time.time() - (time.monotonic() - self.tree_fetched_at),
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls({account['Id']: account for account in snapshot['Accounts']}, snapshot['Roots'], snapshot['OrganizationalUnits'],
+                   snapshot['AccountParents'], time.monotonic() - (time.time() - snapshot['TreeFetchedAt']))
+
+    def to_dict(self):
+        return {
+            'Roots': self.roots,
+            'OrganizationalUnits': list(self.organizational_units.values()),
+            'TotalAccounts': len(self.accounts),
+            'TreeAge': int(time.monotonic() - self.tree_fetched_at),
+        }
+
+def fetch_organization_tree():
+    # 从根开始逐层遍历OU（list_organizational_units_for_parent）及其直属账户（list_children）
+    logger.info("获取组织OU层级")
+    roots = list_all(get_organizations_client().list_roots, 'Roots')
+    organizational_units = {}
+    account_parents = {}
+    parent_ids = [root['Id'] for root in roots]
+    while parent_ids:
+        parent_id = parent_ids.pop()
+        for ou in list_all(get_organizations_client().list_organizational_units_for_parent, 'OrganizationalUnits', ParentId=parent_id):
+            organizational_units[ou['Id']] = {'Id': ou['Id'], 'Name': ou['Name'], 'ParentId': parent_id}
+            parent_ids.append(ou['Id'])
+        for child in list_all(get_organizations_client().list_children, 'Children', ParentId=parent_id, ChildType='ACCOUNT'):
+            account_parents[child['Id']] = parent_id
+    logger.info(f"获取到 {len(roots)} 个根, {len(organizational_units)} 个OU")
+    return roots, organizational_units, account_parents
+
+def load_account_directory(_key):
+    return {account['Id']: account for account in fetch_organization_accounts()}
+
+# 账户目录单独缓存：主页等只需要账户列表（list_accounts），不触发OU层级的遍历
+account_directory_cache = InventoryCache(
+    'account_directory',
+    load_account_directory,
+    ttl=account_directory_ttl,
+    stale_ttl=inventory_cache_stale_ttl,
+    max_entries=1,
+    max_bytes=inventory_cache_max_mb * 1024 * 1024,
+    executor=cache_refresh_executor,
+    on_store=lambda key, accounts: save_snapshot('accounts', ('', key), list(accounts.values()))
+)
+
+def get_account_directory(force_refresh=False):
+    return account_directory_cache.get('accounts', force_refresh=force_refresh)
+
+def load_organization_model(_key):
+    # 只有添加未部署账户、导出OU路径和覆盖矩阵等需要OU层级时才加载。账户来自账户目录缓存；
+    # OU层级按ORGANIZATION_TREE_TTL完整重建，其间只对新增账户调用list_parents增量补全父级OU
+    accounts = get_account_directory()
+    previous = organization_cache.peek('organization')
+    if previous is None or time.monotonic() - previous.tree_fetched_at > organization_tree_ttl:
+        roots, organizational_units, account_parents = fetch_organization_tree()
+        return OrganizationModel(accounts, roots, organizational_units, account_parents, time.monotonic())
+    
+    account_parents = {account_id: parent_id for account_id, parent_id in previous.account_parents.items() if account_id in accounts}
+    new_account_ids = [account_id for account_id in accounts if account_id not in account_parents]
+    logger.info(f"增量刷新组织模型: {len(new_account_ids)} 个新账户")
+    known_parent_ids = set(previous.organizational_units) | {root['Id'] for root in previous.roots}
+    for account_id in new_account_ids:
+        parent_id = call_aws(get_organizations_client().list_parents, ChildId=account_id)['Parents'][0]['Id']
+        if parent_id not in known_parent_ids:
+            # 出现了未知的OU，说明层级已变化，完整重建
+            logger.info(f"发现未知的父级 {parent_id}，重建组织OU层级")
+            roots, organizational_units, account_parents = fetch_organization_tree()
+            return OrganizationModel(accounts, roots, organizational_units, account_parents, time.monotonic())
+        account_parents[account_id] = parent_id
+    return OrganizationModel(accounts, previous.roots, previous.organizational_units, account_parents, previous.tree_fetched_at)
+
+organization_cache = InventoryCache(
+    'organization',
+    load_organization_model,
+    ttl=account_directory_ttl,
+    stale_ttl=inventory_cache_stale_ttl,
+    max_entries=1,
+    max_bytes=inventory_cache_max_mb * 1024 * 1024,
+    executor=cache_refresh_executor,
+    on_store=lambda key, model: save_snapshot('organization', ('', key), model.to_snapshot())
+)
+
+def get_organization_model(force_refresh=False):
+    if force_refresh:
+        get_account_directory(force_refresh=True)
+    return organization_cache.get('organization', force_refresh=force_refresh)
+
+def get_organization_accounts(force_refresh=False):
+    return list(get_account_directory(force_refresh=force_refresh).values())
+
+def warm_start_caches():
+    # 启动时用最近的快照预热缓存，首次访问立即返回快照数据并在后台刷新
+    if not snapshot_store:
+        return
     try:
-        logger.info("处理请求: 列出所有StackSets")
-        # 获取Service-managed的StackSets
-        stack_sets = []
-        next_token = None
-        while True:
-            if next_token:
-                response = cloudformation_client.list_stack_sets(Status='ACTIVE', CallAs='DELEGATED_ADMIN', NextToken=next_token)
+        now = time.time()
+        for (_region, key), accounts, fetched_at in snapshot_store.load_latest('accounts'):
+            account_directory_cache.seed(key, {account['Id']: account for account in accounts}, now - fetched_at)
+        for (_region, key), snapshot, fetched_at in snapshot_store.load_latest('organization'):
+            organization_cache.seed(key, OrganizationModel.from_snapshot(snapshot), now - fetched_at)
+        for key, stack_set, fetched_at in snapshot_store.load_latest('stack_set'):
+            stack_set_cache.seed(key, stack_set, now - fetched_at)
+        instance_snapshots = snapshot_store.load_latest('instances')
+        for key, instances, fetched_at in instance_snapshots:
+            inventory_cache.seed(key, InstanceIndex(instances, now - fetched_at), now - fetched_at)
+        logger.info(f"已从快照预热 {len(instance_snapshots)} 个StackSet的实例缓存")
+    except Exception as e:
+        logger.error(f"从快照预热缓存失败: {str(e)}", exc_info=True)
+
+warm_start_caches()
+
+REMOVABLE_ACCOUNT_STATUSES = {'SUSPENDED', 'CLOSED', 'Deleted'}
+
+def get_account_status(account):
+    # 优先使用较新的State字段（包含CLOSED），否则使用Status
+    return account.get('State') or account.get('Status')
+
+def describe_account_status(account_id):
+    try:
+        account_status = get_account_status(call_aws(get_organizations_client().describe_account, AccountId=account_id)['Account'])
+        logger.info(f"账户 {account_id} 状态: {account_status}")
+    except Exception as e:
+        logger.warning(f"无法获取账户 {account_id} 状态，可能已被删除: {str(e)}")
+        account_status = 'Deleted'
+    return account_status
+
+def resolve_account_statuses(account_ids):
+    # 从账户目录中O(1)查询状态，只对目录中不存在的账户并发调用describe_account确认
+    directory = get_account_directory()
+    statuses = {account_id: get_account_status(directory[account_id]) for account_id in account_ids if account_id in directory}
+    missing_account_ids = [account_id for account_id in account_ids if account_id not in directory]
+    if missing_account_ids:
+        logger.info(f"{len(missing_account_ids)} 个账户不在组织账户列表中，调用describe_account确认")
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='describe-account') as executor:
+            statuses.update(zip(missing_account_ids, executor.map(describe_account_status, missing_account_ids)))
+    return statuses
+
+def get_instance_index(stack_set_name, stack_set_region=None, force_refresh=False):
+    return inventory_cache.get(stack_set_key(stack_set_name, stack_set_region), force_refresh=force_refresh)
+
+def instance_target(instance):
+    return {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
+
+# 可下推到list_stack_instances的过滤维度及对应的Filters名称
+SERVER_SIDE_FILTERS = {
+    'status': 'DETAILED_STATUS',
+    'drift': 'DRIFT_STATUS',
+}
+
+def get_server_side_filters(filters):
+    # 服务端每个过滤名称只接受一个值，多值条件无法下推时返回None
+    server_side_filters = []
+    for field, values in filters.items():
+        if not values or field not in SERVER_SIDE_FILTERS:
+            continue
+        values = set(values)
+        if len(values) != 1:
+            return None
+        server_side_filters.append({'Name': SERVER_SIDE_FILTERS[field], 'Values': values.pop()})
+    return server_side_filters or None
+
+def query_instances(stack_set_name, stack_set_region=None, ignore_accounts=(), **filters):
+    # 缓存中已有索引时直接查询；缓存为空时将状态条件下推到服务端，只拉取匹配的页面，
+    # 其余条件（账户、区域、OU）在本地过滤，结果不写入缓存
+    key = stack_set_key(stack_set_name, stack_set_region)
+    server_side_filters = get_server_side_filters(filters)
+    if inventory_cache.peek(key) is None and server_side_filters:
+        index = InstanceIndex(fetch_stack_instances(stack_set_name, stack_set_region, filters=server_side_filters))
+    else:
+        index = get_instance_index(stack_set_name, stack_set_region)
+    return [instance_target(instance) for instance in index.query(ignore_accounts=ignore_accounts, **filters)]
+
+def get_stack_set(stack_set_name, stack_set_region=None, force_refresh=False):
+    return stack_set_cache.get(stack_set_key(stack_set_name, stack_set_region), force_refresh=force_refresh)
+
+def get_target_regions(stack_set_info, index, stack_set_region=None):
+    # StackSet关联的部署区域；旧的StackSet没有Regions字段时使用实例中出现过的区域
+    return sorted(stack_set_info.get('Regions') or index.buckets['region'] or [stack_set_region or aws_region])
+
+def get_deployable_account_ids(directory):
+    # 已挂起或关闭的账户无法部署，不计为未部署（与覆盖矩阵一致）
+    return [account_id for account_id, account in directory.items() if get_account_status(account) not in REMOVABLE_ACCOUNT_STATUSES]
+
+def get_undeployed_regions(stack_set_name, stack_set_region=None, account_ids=None):
+    # 按 (账户, 区域) 计算未部署的组合，返回 {账户ID: [缺失的区域]}；只考虑可部署的账户
+    index = get_instance_index(stack_set_name, stack_set_region)
+    target_regions = set(get_target_regions(get_stack_set(stack_set_name, stack_set_region), index, stack_set_region))
+    directory = get_account_directory()
+    deployable_account_ids = get_deployable_account_ids(directory)
+    if account_ids is not None:
+        account_ids = set(account_ids)
+        deployable_account_ids = [account_id for account_id in deployable_account_ids if account_id in account_ids]
+    undeployed = {}
+    for account_id in deployable_account_ids:
+        missing_regions = target_regions - index.account_regions.get(account_id, set())
+        if missing_regions:
+            undeployed[account_id] = sorted(missing_regions)
+    return undeployed
+
+def call_stack_set_operation(operation_name, stack_set_region=None, **kwargs):
+    # 调用create/update/delete_stack_instances；操作结束后由refresh_inventory_after_operation更新缓存，
+    # 调用出错时无法确定是否已生效，直接使缓存失效
+    try:
+        return call_aws(getattr(get_cloudformation_client(stack_set_region), operation_name), **kwargs)
+    except Exception:
+        inventory_cache.invalidate(stack_set_key(kwargs['StackSetName'], stack_set_region))
+        raise
+
+STACK_SET_OPERATION_FINAL_STATUSES = {'SUCCEEDED', 'FAILED', 'STOPPED'}
+
+def get_operation_preferences(overrides=None):
+    # 默认使用环境变量中的操作偏好，请求中的operationPreferences可覆盖
+    preferences = {
+        'RegionConcurrencyType': operation_region_concurrency_type,
+        'MaxConcurrentPercentage': operation_max_concurrent_percentage,
+        'FailureTolerancePercentage': operation_failure_tolerance_percentage,
+    }
+    preferences.update(overrides or {})
+    # 同一类参数只能指定Count或Percentage之一
+    if 'MaxConcurrentCount' in preferences:
+        preferences.pop('MaxConcurrentPercentage', None)
+    if 'FailureToleranceCount' in preferences:
+        preferences.pop('FailureTolerancePercentage', None)
+    return preferences
+
+def plan_stack_set_operations(targets, max_accounts=None):
+    # 将 (账户, 区域, OU) 目标合并为尽可能少的操作：
+    # 需要相同区域集合的账户合并为一次调用（按OU排序，每次调用带上涉及的OU），仅在超过单次账户上限时拆分
+    max_accounts = max_accounts or operation_max_accounts
+    account_regions = {}
+    for target in targets:
+        key = (target['OrganizationalUnitId'], target['Account'])
+        account_regions.setdefault(key, set()).add(target['Region'])
+    
+    groups = {}
+    for (ou_id, account_id), regions in account_regions.items():
+        groups.setdefault(tuple(sorted(regions)), []).append((ou_id, account_id))
+    
+    batches = []
+    for regions, ou_accounts in sorted(groups.items()):
+        ou_accounts.sort()
+        for start in range(0, len(ou_accounts), max_accounts):
+            chunk = ou_accounts[start:start + max_accounts]
+            batches.append({
+                'OrganizationalUnitIds': sorted({ou_id for ou_id, _ in chunk}),
+                'Accounts': sorted({account_id for _, account_id in chunk}),
+                'Regions': list(regions),
+            })
+    return batches
+
+def wait_for_stack_set_operation(stack_set_name, operation_id, stack_set_region=None, on_poll=None):
+    deadline = time.monotonic() + operation_timeout
+    while True:
+        operation = call_aws(get_cloudformation_client(stack_set_region).describe_stack_set_operation, StackSetName=stack_set_name,
+                             OperationId=operation_id, CallAs='DELEGATED_ADMIN')['StackSetOperation']
+        if on_poll:
+            on_poll(operation)
+        if operation['Status'] in STACK_SET_OPERATION_FINAL_STATUSES:
+            logger.info(f"StackSet {stack_set_name} 操作 {operation_id} 结束，状态: {operation['Status']}")
+            return operation
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for operation {operation_id} on StackSet {stack_set_name}")
+        time.sleep(operation_poll_interval)
+
+# 操作结果状态对应的实例DetailedStatus；PENDING或RUNNING说明结果尚未完成
+OPERATION_RESULT_STATUSES = {'SUCCEEDED': 'SUCCEEDED', 'FAILED': 'FAILED', 'CANCELLED': 'CANCELLED'}
+
+def fetch_operation_results(stack_set_name, stack_set_region, operation_id):
+    return list_all(get_cloudformation_client(stack_set_region).list_stack_set_operation_results, 'Summaries',
+                    StackSetName=stack_set_name, OperationId=operation_id, CallAs='DELEGATED_ADMIN', MaxResults=100)
+
+def plan_operation_changes(index, operation_name, results, expected_count):
+    # 将操作结果转换为 (账户, 区域) 的实例变化；结果未完成、数量不符或与索引不一致时返回None
+    changes = {}
+    for result in results:
+        status = OPERATION_RESULT_STATUSES.get(result['Status'])
+        if status is None:
+            return None
+        instance_key = (result['Account'], result['Region'])
+        current = index.get(*instance_key)
+        if operation_name == 'delete_stack_instances' and status == 'SUCCEEDED':
+            if current is None:
+                return None
+            changes[instance_key] = None
+        elif current is None:
+            if operation_name != 'create_stack_instances':
+                return None
+            changes[instance_key] = {
+                'Account': result['Account'],
+                'Region': result['Region'],
+                'OrganizationalUnitId': result.get('OrganizationalUnitId') or get_organization_model().get_parent_id(result['Account']),
+                'DetailedStatus': status,
+                'DriftStatus': 'NOT_CHECKED',
+            }
+        else:
+            # 实例更新成功后需要重新检测漂移
+            changes[instance_key] = dict(current, DetailedStatus=status,
+                                         DriftStatus='NOT_CHECKED' if status == 'SUCCEEDED' else current['DriftStatus'])
+    if len(changes) != expected_count:
+        return None
+    return changes
+
+def refresh_inventory_after_operation(operation_name, stack_set_name, stack_set_region, operation_id, batch):
+    # 只把操作结果涉及的实例应用到缓存的索引，调用次数与变化规模相关而非实例总数；
+    # 索引超过INVENTORY_RESCAN_INTERVAL未全量扫描、结果不一致或更新失败时使缓存失效，下次访问时全量重新扫描
+    key = stack_set_key(stack_set_name, stack_set_region)
+    index = inventory_cache.peek(key)
+    if index is None:
+        return
+    result = 'rescan'
+    try:
+        if time.monotonic() - index.scanned_at < inventory_rescan_interval:
+            results = fetch_operation_results(stack_set_name, stack_set_region, operation_id)
+            changes = plan_operation_changes(index, operation_name, results, len(batch['Accounts']) * len(batch['Regions']))
+            if changes is None:
+                logger.info(f"StackSet {stack_set_name} 操作 {operation_id} 的结果与缓存不一致")
+            elif inventory_cache.replace(key, index, index.with_changes(changes)):
+                result = 'applied'
+                logger.info(f"StackSet {stack_set_name} 操作 {operation_id} 结束，增量更新 {len(changes)} 个实例")
             else:
-                response = cloudformation_client.list_stack_sets(Status='ACTIVE', CallAs='DELEGATED_ADMIN')
-            
-            stack_sets.extend(response.get('Summaries', []))
-            next_token = response.get('NextToken')
-            if not next_token:
-                break
+                # 期间已有更新的全量扫描替换了缓存条目，保留该结果
+                result = 'superseded'
+                logger.info(f"StackSet {stack_set_name} 操作 {operation_id} 结束，缓存已被更新的扫描替换")
+    except Exception as e:
+        logger.error(f"StackSet {stack_set_name} 操作 {operation_id} 增量更新缓存失败: {str(e)}", exc_info=True)
+    if result == 'rescan':
+        inventory_cache.invalidate(key)
+    metrics.inc('inventory_incremental_updates_total', {'result': result})
+
+def retry_operation_in_progress(stack_set_name, start):
+    # 同一StackSet同时只能运行一个操作，遇到OperationInProgressException时等待后重试
+    deadline = time.monotonic() + operation_timeout
+    while True:
+        try:
+            return start()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'OperationInProgressException' or time.monotonic() > deadline:
+                raise
+            logger.info(f"StackSet {stack_set_name} 有操作正在运行，{operation_poll_interval}s 后重试")
+            time.sleep(operation_poll_interval)
+
+def start_operation_idempotently(stack_set_name, operation_id, start):
+    # OperationId同时是幂等令牌：call_aws重试或等待OperationInProgressException后重试时使用同一个ID，
+    # 已被CloudFormation接受的请求不会重复执行
+    def start_once():
+        try:
+            return start()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'OperationIdAlreadyExistsException':
+                raise
+            logger.info(f"StackSet {stack_set_name} 操作 {operation_id} 已被接受，不再重复启动")
+            return operation_id
+
+    return retry_operation_in_progress(stack_set_name, start_once)
+
+def start_stack_set_operation(operation_name, stack_set_name, stack_set_region, batch, operation_preferences, **kwargs):
+    operation_id = str(uuid.uuid4())
+
+    def start():
+        response = call_stack_set_operation(
+            operation_name,
+            stack_set_region,
+            StackSetName=stack_set_name,
+            DeploymentTargets={
+                'Accounts': batch['Accounts'],
+                'OrganizationalUnitIds': batch['OrganizationalUnitIds'],
+                'AccountFilterType': 'INTERSECTION',
+            },
+            Regions=batch['Regions'],
+            OperationPreferences=operation_preferences,
+            OperationId=operation_id,
+            CallAs='DELEGATED_ADMIN',
+            **kwargs
+        )
+        logger.info(f"StackSet {stack_set_name} 启动操作 {response['OperationId']}: "
+                    f"{len(batch['Accounts'])} 个账户, 区域 {batch['Regions']}, OU {batch['OrganizationalUnitIds']}")
+        return response['OperationId']
+    
+    return start_operation_idempotently(stack_set_name, operation_id, start)
+
+def execute_operation_plan(operation_name, stack_set_name, stack_set_region, batches, operation_preferences, job=None, **kwargs):
+    # 按顺序执行批次：每个操作结束后才提交下一个，并在任务中记录操作ID和轮询结果
+    operations = []
+    for batch in batches:
+        operation_id = start_stack_set_operation(operation_name, stack_set_name, stack_set_region, batch, operation_preferences, **kwargs)
+        operation_record = {
+            'OperationId': operation_id,
+            'Status': 'RUNNING',
+            'Accounts': len(batch['Accounts']),
+            'Regions': batch['Regions'],
+            'OrganizationalUnitIds': batch['OrganizationalUnitIds'],
+        }
+        operations.append(operation_record)
+        if job:
+            job.update(operations=operations)
+
+        def on_poll(stack_set_operation):
+            operation_record['Status'] = stack_set_operation['Status']
+            operation_record['StatusDetails'] = stack_set_operation.get('StatusDetails', {})
+            operation_record['StatusReason'] = stack_set_operation.get('StatusReason')
+            if job:
+                job.update(operations=operations)
+
+        try:
+            wait_for_stack_set_operation(stack_set_name, operation_id, stack_set_region, on_poll=on_poll)
+        except Exception:
+            inventory_cache.invalidate(stack_set_key(stack_set_name, stack_set_region))
+            raise
+        refresh_inventory_after_operation(operation_name, stack_set_name, stack_set_region, operation_id, batch)
+        if job:
+            job.update(completed=job.completed + 1)
+    return operations
+
+JOB_FINAL_STATUSES = {'SUCCEEDED', 'FAILED'}
 
-        logger.info(f"获取到 {len(stack_sets)} 个StackSets")
-        
-        # 获取组织中的所有账户
-        organization_accounts = get_organization_accounts()
-        total_organization_accounts = len(organization_accounts)
-        
-        # 获取所有StackSet的详细信息
-        stack_set_details_list = []
-        for stack_set in stack_sets:
-            stack_set_name = stack_set['StackSetName']
-            logger.info(f"获取StackSet详情: {stack_set_name}")
-            stack_set_details = cloudformation_client.describe_stack_set(StackSetName=stack_set_name, CallAs='DELEGATED_ADMIN')
-            stack_set_info = stack_set_details['StackSet']
-            
-            auto_deployment = stack_set_info.get('AutoDeployment', {})
-            
-            # 获取stack instances的详细信息
-            get_stack_instances.cache_clear()
-            instances = get_stack_instances(stack_set_name)
-            
-            total_instances = len(instances)
-            in_sync = sum(1 for instance in instances if instance['DriftStatus'] == 'IN_SYNC')
-            drifted = sum(1 for instance in instances if instance['DriftStatus'] == 'DRIFTED')
-            succeeded = sum(1 for instance in instances if instance['StackInstanceStatus']['DetailedStatus'] == 'SUCCEEDED')
-            failed = sum(1 for instance in instances if instance['StackInstanceStatus']['DetailedStatus'] == 'FAILED')
-            skipped_suspended_account = sum(1 for instance in instances if instance['StackInstanceStatus']['DetailedStatus'] == 'SKIPPED_SUSPENDED_ACCOUNT')
-            
-            # 计算未推送StackSet的账户
-            deployed_account_ids = {instance['Account'] for instance in instances}
-            not_deployed_accounts = [account for account in organization_accounts if account['Id'] not in deployed_account_ids]
-            
-            logger.info(f"StackSet {stack_set_name} 统计: 总实例={total_instances}, 同步={in_sync}, 偏差={drifted}, "
-                      f"成功={succeeded}, 失败={failed}, 跳过账户={skipped_suspended_account}, 未部署账户={len(not_deployed_accounts)}")
-            
-            stack_set_details_list.append({
+class Job:
+    # 后台任务状态；每次更新递增版本号并唤醒等待中的事件流
+    def __init__(self, job_type, stack_set_name, stack_set_region=None, total=0):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.stack_set_name = stack_set_name
+        self.stack_set_region = stack_set_region or aws_region
+        self.status = 'PENDING'
+        self.total = total
+        self.completed = 0
+        self.operations = []
+        self.result = None
+        self.error = None
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.updated_at = self.created_at
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def update(self, **changes):
+        with self.condition:
+            for key, value in changes.items():
+                setattr(self, key, value)
+            self.updated_at = datetime.datetime.now(datetime.timezone.utc)
+            self.version += 1
+            self.condition.notify_all()
+
+    @property
+    def finished(self):
+        return self.status in JOB_FINAL_STATUSES
+
+    def to_dict(self):
+        with self.condition:
+            return {
+                'jobId': self.id,
+                'type': self.type,
+                'stackSetName': self.stack_set_name,
+                'stackSetRegion': self.stack_set_region,
+                'status': self.status,
+                'progress': {'total': self.total, 'completed': self.completed},
+                'operations': [dict(operation) for operation in self.operations],
+                'result': self.result,
+                'error': self.error,
+                'createdAt': self.created_at.isoformat(),
+                'updatedAt': self.updated_at.isoformat(),
+            }
+
+class JobManager:
+    def __init__(self, executor, retention):
+        self.executor = executor
+        self.retention = retention
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, job_type, stack_set_name, func, *args, stack_set_region=None, total=0, **kwargs):
+        job = Job(job_type, stack_set_name, stack_set_region=stack_set_region, total=total)
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+        logger.info(f"提交任务 {job.id}: {job_type} StackSet {stack_set_name}")
+        self.executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        job.update(status='RUNNING')
+        try:
+            result = func(job, *args, **kwargs)
+            job.update(status='SUCCEEDED', result=result)
+            logger.info(f"任务 {job.id} 完成")
+        except Exception as e:
+            logger.error(f"任务 {job.id} 失败: {str(e)}", exc_info=True)
+            job.update(status='FAILED', error=str(e))
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def _prune(self):
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=self.retention)
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and job.updated_at < cutoff:
+                del self.jobs[job_id]
+
+job_executor = ThreadPoolExecutor(max_workers=job_max_workers, thread_name_prefix='job')
+job_manager = JobManager(job_executor, job_retention)
+
+def run_operation_job(job, operation_name, stack_set_name, stack_set_region, batches, operation_preferences, **kwargs):
+    operations = execute_operation_plan(operation_name, stack_set_name, stack_set_region, batches, operation_preferences, job=job, **kwargs)
+    failed_operations = [op['OperationId'] for op in operations if op['Status'] != 'SUCCEEDED']
+    if failed_operations:
+        raise Exception(f"StackSet operations did not succeed: {', '.join(failed_operations)}")
+    return {'operationIds': [op['OperationId'] for op in operations]}
+
+def submit_operation_job(job_type, operation_name, stack_set_name, stack_set_region, targets, operation_preferences, **kwargs):
+    # 规划批次后提交后台任务，立即返回任务
+    batches = plan_stack_set_operations(targets)
+    logger.info(f"StackSet {stack_set_name} ({stack_set_region or aws_region}) 共 {len(targets)} 个目标，合并为 {len(batches)} 个操作")
+    return job_manager.submit(job_type, stack_set_name, run_operation_job, operation_name, stack_set_name, stack_set_region, batches,
+                              operation_preferences, stack_set_region=stack_set_region, total=len(batches), **kwargs)
+
+def plan_add_undeployed_accounts(stack_set_name, stack_set_region=None, ignore_accounts=()):
+    # 返回未部署的账户（含MissingRegions）及按真实父级OU生成的 (账户, 区域) 目标
+    organization_model = get_organization_model()
+    undeployed_regions = get_undeployed_regions(stack_set_name, stack_set_region, organization_model.accounts.keys() - set(ignore_accounts))
+    accounts = [{**account, 'MissingRegions': undeployed_regions[account['Id']]}
+                for account in organization_model.accounts.values() if account['Id'] in undeployed_regions]
+    targets = [{'Account': account_id, 'Region': region, 'OrganizationalUnitId': organization_model.get_parent_id(account_id)}
+               for account_id, regions in undeployed_regions.items() for region in regions]
+    return accounts, targets
+
+def plan_remove_suspended_accounts(stack_set_name, stack_set_region=None, ignore_accounts=()):
+    # SKIPPED_SUSPENDED_ACCOUNT实例中，账户确认已挂起、关闭或删除的才会移除
+    instances = query_instances(stack_set_name, stack_set_region, ignore_accounts=ignore_accounts, status=['SKIPPED_SUSPENDED_ACCOUNT'])
+    logger.info(f"发现 {len(instances)} 个潜在的暂停账户实例")
+    account_statuses = resolve_account_statuses({instance['Account'] for instance in instances})
+    instances = [dict(instance, Status=account_statuses[instance['Account']]) for instance in instances
+                 if account_statuses[instance['Account']] in REMOVABLE_ACCOUNT_STATUSES]
+    return instances, instances
+
+def plan_retry_failed_instances(stack_set_name, stack_set_region=None, ignore_accounts=()):
+    instances = query_instances(stack_set_name, stack_set_region, ignore_accounts=ignore_accounts, status=['FAILED'])
+    return instances, instances
+
+def plan_retry_drifted_instances(stack_set_name, stack_set_region=None, ignore_accounts=()):
+    instances = query_instances(stack_set_name, stack_set_region, ignore_accounts=ignore_accounts, drift=['DRIFTED'])
+    return instances, instances
+
+# Web端点和命令行共用的操作流程：plan返回 (展示给用户的条目, 操作目标)
+STACK_SET_ACTIONS = {
+    'add_undeployed_accounts': {
+        'plan': plan_add_undeployed_accounts,
+        'job_type': 'ADD_UNDEPLOYED_ACCOUNTS',
+        'operation_name': 'create_stack_instances',
+        'operation_kwargs': {},
+    },
+    'remove_suspended_accounts': {
+        'plan': plan_remove_suspended_accounts,
+        'job_type': 'REMOVE_SUSPENDED_ACCOUNTS',
+        'operation_name': 'delete_stack_instances',
+        'operation_kwargs': {'RetainStacks': True},
+    },
+    'retry_failed_instances': {
+        'plan': plan_retry_failed_instances,
+        'job_type': 'RETRY_FAILED_INSTANCES',
+        'operation_name': 'update_stack_instances',
+        'operation_kwargs': {},
+    },
+    'retry_drifted_instances': {
+        'plan': plan_retry_drifted_instances,
+        'job_type': 'RETRY_DRIFTED_INSTANCES',
+        'operation_name': 'update_stack_instances',
+        'operation_kwargs': {},
+    },
+}
+
+def plan_stack_set_action(action, stack_set_name, stack_set_region=None, ignore_accounts=()):
+    return STACK_SET_ACTIONS[action]['plan'](stack_set_name, stack_set_region, ignore_accounts)
+
+def submit_stack_set_action(action, stack_set_name, stack_set_region, targets, operation_preferences):
+    # 以后台任务执行，立即返回任务
+    spec = STACK_SET_ACTIONS[action]
+    return submit_operation_job(spec['job_type'], spec['operation_name'], stack_set_name, stack_set_region, targets,
+                                operation_preferences, **spec['operation_kwargs'])
+
+def run_stack_set_action(action, stack_set_name, stack_set_region, targets, operation_preferences):
+    # 在当前线程中执行并等待所有操作结束（供命令行使用）
+    spec = STACK_SET_ACTIONS[action]
+    return run_operation_job(None, spec['operation_name'], stack_set_name, stack_set_region, plan_stack_set_operations(targets),
+                             operation_preferences, **spec['operation_kwargs'])
+
+# 所有漂移检测任务共用，限制同时运行的漂移检测操作数量
+drift_detection_executor = ThreadPoolExecutor(max_workers=drift_detection_concurrency, thread_name_prefix='drift')
+
+def detect_stack_set_drift(stack_set_name, stack_set_region, operation_preferences, on_poll=None):
+    # 启动漂移检测并等待结束，之后只刷新该StackSet的实例缓存
+    operation_id = str(uuid.uuid4())
+
+    def start():
+        response = call_aws(get_cloudformation_client(stack_set_region).detect_stack_set_drift, StackSetName=stack_set_name,
+                            OperationPreferences=operation_preferences, OperationId=operation_id, CallAs='DELEGATED_ADMIN')
+        logger.info(f"StackSet {stack_set_name} ({stack_set_region or aws_region}) 启动漂移检测 {response['OperationId']}")
+        return response['OperationId']
+    
+    operation_id = start_operation_idempotently(stack_set_name, operation_id, start)
+    if on_poll:
+        on_poll({'OperationId': operation_id, 'Status': 'RUNNING'})
+    operation = wait_for_stack_set_operation(stack_set_name, operation_id, stack_set_region, on_poll=on_poll)
+    inventory_cache.invalidate(stack_set_key(stack_set_name, stack_set_region))
+    get_instance_index(stack_set_name, stack_set_region)
+    return operation
+
+def run_drift_detection_job(job, stack_set_keys, operation_preferences):
+    # 并发对多个StackSet进行漂移检测，每个StackSet同时只有一个操作
+    operations = [{'StackSetName': stack_set_name, 'StackSetRegion': stack_set_region, 'OperationId': None, 'Status': 'PENDING'}
+                  for stack_set_region, stack_set_name in stack_set_keys]
+    lock = threading.Lock()
+
+    def detect(operation_record):
+        def on_poll(stack_set_operation):
+            with lock:
+                operation_record['OperationId'] = stack_set_operation['OperationId']
+                operation_record['Status'] = stack_set_operation['Status']
+                operation_record['DriftDetectionDetails'] = stack_set_operation.get('StackSetDriftDetectionDetails', {})
+                job.update(operations=operations)
+
+        try:
+            detect_stack_set_drift(operation_record['StackSetName'], operation_record['StackSetRegion'], operation_preferences, on_poll=on_poll)
+        except Exception as e:
+            logger.error(f"StackSet {operation_record['StackSetName']} 漂移检测失败: {str(e)}", exc_info=True)
+            with lock:
+                operation_record['Status'] = 'FAILED'
+                operation_record['StatusReason'] = str(e)
+        with lock:
+            job.update(operations=operations, completed=job.completed + 1)
+
+    futures = [drift_detection_executor.submit(detect, operation_record) for operation_record in operations]
+    for future in futures:
+        future.result()
+    failed_stack_sets = [op['StackSetName'] for op in operations if op['Status'] != 'SUCCEEDED']
+    if failed_stack_sets:
+        raise Exception(f"Drift detection did not succeed: {', '.join(failed_stack_sets)}")
+    return {'operationIds': [op['OperationId'] for op in operations]}
+
+stack_set_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stackset')
+
+def get_stack_set_details(stack_set_name, stack_set_region, organization_account_ids, force_refresh=False):
+    stack_set_info = get_stack_set(stack_set_name, stack_set_region, force_refresh=force_refresh)
+    
+    auto_deployment = stack_set_info.get('AutoDeployment', {})
+    
+    # 获取stack instances的索引，计数已在建立索引时统计
+    index = get_instance_index(stack_set_name, stack_set_region, force_refresh=force_refresh)
+    
+    total_instances = len(index)
+    in_sync = index.count('drift', 'IN_SYNC')
+    drifted = index.count('drift', 'DRIFTED')
+    succeeded = index.count('status', 'SUCCEEDED')
+    failed = index.count('status', 'FAILED')
+    skipped_suspended_account = index.count('status', 'SKIPPED_SUSPENDED_ACCOUNT')
+    
+    # 按 (账户, 区域) 计算未推送StackSet的账户数，账户详情在打开弹窗时通过 /get_not_deployed_accounts 获取
+    target_regions = set(get_target_regions(stack_set_info, index, stack_set_region))
+    not_deployed_accounts = 0
+    not_deployed_instances = 0
+    for account_id in organization_account_ids:
+        missing_regions = len(target_regions - index.account_regions.get(account_id, set()))
+        if missing_regions:
+            not_deployed_accounts += 1
+            not_deployed_instances += missing_regions
+    
+    logger.info(f"StackSet {stack_set_name} ({stack_set_region}) 统计: 总实例={total_instances}, 同步={in_sync}, 偏差={drifted}, "
+              f"成功={succeeded}, 失败={failed}, 跳过账户={skipped_suspended_account}, 未部署账户={not_deployed_accounts}")
+    
+    return {
+        'StackSetName': stack_set_name,
+        'StackSetRegion': stack_set_region,
+        'Regions': sorted(target_regions),
+        'AutoDeployment': auto_deployment,
+        'TotalInstances': total_instances,
+        'InSync': in_sync,
+        'Drifted': drifted,
+        'Succeeded': succeeded,
+        'Failed': failed,
+        'SkippedSuspendedAccount': skipped_suspended_account,
+        'NotDeployedAccounts': not_deployed_accounts,
+        'NotDeployedInstances': not_deployed_instances
+    }
+
+def list_active_stack_sets(stack_set_region=None):
+    # 获取指定主区域中Service-managed的StackSets
+    stack_sets = list_all(get_cloudformation_client(stack_set_region).list_stack_sets, 'Summaries', Status='ACTIVE', CallAs='DELEGATED_ADMIN')
+    logger.info(f"区域 {stack_set_region or aws_region} 获取到 {len(stack_sets)} 个StackSets")
+    return stack_sets
+
+# 多个用户同时打开主页时，同一区域的StackSet列表只请求一次
+stack_set_list_cache = InventoryCache(
+    'stack_set_list',
+    list_active_stack_sets,
+    ttl=inventory_cache_ttl,
+    stale_ttl=inventory_cache_stale_ttl,
+    max_entries=len(stack_set_regions),
+    max_bytes=inventory_cache_max_mb * 1024 * 1024,
+    executor=cache_refresh_executor,
+)
+
+def list_all_stack_sets(cached=False):
+    # 并行列出所有主区域中的StackSets，返回 (区域, 名称) 列表；默认总是重新列出（并发请求共享同一次调用），
+    # cached为True时使用INVENTORY_CACHE_TTL内缓存的列表
+    region_futures = [(region, stack_set_executor.submit(stack_set_list_cache.get, region, force_refresh=not cached))
+                      for region in stack_set_regions]
+    return [(region, stack_set['StackSetName']) for region, future in region_futures for stack_set in future.result()]
+
+def iter_stack_set_details(force_refresh=False, ordered=False):
+    # 并发获取所有StackSet的详细信息；ordered为False时按完成顺序逐个返回
+    with server_timing('list'):
+        stack_set_keys = list_all_stack_sets()
+    with server_timing('organization'):
+        organization_account_ids = get_deployable_account_ids(get_account_directory(force_refresh=force_refresh))
+    futures = {stack_set_executor.submit(get_stack_set_details, stack_set_name, stack_set_region, organization_account_ids, force_refresh): (stack_set_region, stack_set_name)
+               for stack_set_region, stack_set_name in stack_set_keys}
+    with server_timing('details'):
+        for future in (futures if ordered else as_completed(futures)):
+            stack_set_region, stack_set_name = futures[future]
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error(f"获取StackSet {stack_set_name} ({stack_set_region}) 详情时出错: {str(e)}", exc_info=True)
+                yield {'StackSetName': stack_set_name, 'StackSetRegion': stack_set_region, 'Error': str(e)}
+
+def stream_stack_set_details_ndjson(force_refresh):
+    try:
+        for details in iter_stack_set_details(force_refresh=force_refresh):
+            yield json.dumps(details, default=str) + '\n'
+    except Exception as e:
+        logger.error(f"列出StackSets时出错: {str(e)}", exc_info=True)
+        yield json.dumps({'Error': str(e)}) + '\n'
+
+def stream_stack_set_rows(force_refresh):
+    try:
+        yield from iter_stack_set_details(force_refresh=force_refresh)
+    except Exception as e:
+        logger.error(f"列出StackSets时出错: {str(e)}", exc_info=True)
+        yield {'StackSetName': '', 'Error': str(e)}
+
+def to_bitset(positions, size):
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+def bitset_positions(bits):
+    # 按字节遍历，稀疏位集只检查非零字节
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    return [offset * 8 + bit for offset, byte in enumerate(data) if byte for bit in range(8) if byte >> bit & 1]
+
+class CoverageRow:
+    def __init__(self, key, generation, stack_set_info, index, target_regions, region_bits, failed, drifted):
+        self.key = key
+        self.generation = generation
+        self.stack_set_info = stack_set_info
+        # 只保留索引的弱引用，索引被缓存淘汰后行仍然可用
+        self.index = weakref.ref(index)
+        self.built_at = time.monotonic()
+        self.target_regions = target_regions
+        self.region_bits = region_bits
+        self.deployed = functools.reduce(operator.and_, (region_bits.get(region, 0) for region in target_regions)) if target_regions else 0
+        self.failed = failed
+        self.drifted = drifted
+
+class CoverageMatrix:
+    # 账户×StackSet覆盖矩阵：账户按组织账户列表映射为位置，每个StackSet按账户保存位集（Python int）：
+    # 每个目标区域是否已部署、存在FAILED实例、存在DRIFTED实例。所有目标区域的位集求与即为完整部署
+    STATES = ('missing', 'failed', 'drifted')
+
+    def __init__(self, organization_model):
+        self.organization_model = organization_model
+        self.account_ids = sorted(organization_model.accounts)
+        self.account_positions = {account_id: position for position, account_id in enumerate(self.account_ids)}
+        # 已挂起或关闭的账户无法部署，不计入缺失
+        self.active = to_bitset((position for position, account_id in enumerate(self.account_ids)
+                                 if get_account_status(organization_model.accounts[account_id]) not in REMOVABLE_ACCOUNT_STATUSES),
+                                len(self.account_ids))
+        self.rows = {}
+        self.errors = []
+        self.built_at = time.monotonic()
+
+    def same_accounts(self, other):
+        return self.account_ids == other.account_ids and self.active == other.active
+
+    def is_current(self):
+        # 未超过INVENTORY_CACHE_TTL、组织模型未刷新且所有StackSet的实例缓存未失效或更新时可直接复用
+        return (not self.errors and time.monotonic() - self.built_at < inventory_cache.ttl
+                and organization_cache.peek('organization') is self.organization_model
+                and all(row.generation == inventory_cache.generation(key) for key, row in self.rows.items()))
+
+    def build_row(self, key, generation, stack_set_info, index):
+        stack_set_region, _stack_set_name = key
+        target_regions = frozenset(get_target_regions(stack_set_info, index, stack_set_region))
+        region_bits = {region: self._bitset(index, 'region', region) for region in index.buckets['region']}
+        return CoverageRow(key, generation, stack_set_info, index, target_regions, region_bits,
+                           self._bitset(index, 'status', 'FAILED'), self._bitset(index, 'drift', 'DRIFTED'))
+
+    def _bitset(self, index, field, value):
+        accounts, account_column = index.values['account'], index.columns['account']
+        account_positions = self.account_positions
+        return to_bitset({account_positions[accounts[account_column[position]]]
+                          for position in index.buckets[field].get(value, ())
+                          if accounts[account_column[position]] in account_positions}, len(self.account_ids))
+
+    def select(self, patterns=()):
+        rows = sorted(self.rows.values(), key=lambda row: (row.key[1], row.key[0]))
+        if patterns:
+            rows = [row for row in rows if any(fnmatch.fnmatchcase(row.key[1], pattern) for pattern in patterns)]
+        return rows
+
+    def state_bits(self, row, state):
+        if state == 'missing':
+            return self.active & ~row.deployed
+        if state == 'failed':
+            return row.failed
+        if state == 'drifted':
+            return row.drifted
+        raise ValueError(f"Unsupported state: {state}")
+
+    def summary(self, rows):
+        return [{'StackSetName': row.key[1], 'StackSetRegion': row.key[0], 'Regions': sorted(row.target_regions),
+                 'Deployed': row.deployed.bit_count(), 'Missing': self.state_bits(row, 'missing').bit_count(),
+                 'Failed': row.failed.bit_count(), 'Drifted': row.drifted.bit_count()}
+                for row in rows]
+
+    def gaps(self, rows, state, min_count=1, ignore_accounts=()):
+        # 返回在至少min_count个所选StackSet中处于state状态的账户，按StackSet数量降序
+        stack_sets_by_position = {}
+        for row in rows:
+            for position in bitset_positions(self.state_bits(row, state)):
+                stack_sets_by_position.setdefault(position, []).append(row.key)
+        gaps = []
+        for position, keys in stack_sets_by_position.items():
+            account_id = self.account_ids[position]
+            if len(keys) < min_count or account_id in ignore_accounts:
+                continue
+            account = self.organization_model.accounts[account_id]
+            gaps.append({'Account': account_id, 'Name': account.get('Name'), 'Status': get_account_status(account),
+                         'OrganizationalUnitId': self.organization_model.get_parent_id(account_id), 'Count': len(keys),
+                         'StackSets': [{'StackSetName': stack_set_name, 'StackSetRegion': stack_set_region}
+                                       for stack_set_region, stack_set_name in keys]})
+        gaps.sort(key=lambda gap: (-gap['Count'], gap['Account']))
+        return gaps
+
+    def account(self, account_id, rows):
+        # 单个账户在每个StackSet中的状态及缺失的区域
+        position = self.account_positions[account_id]
+        return [{
+            'StackSetName': row.key[1],
+            'StackSetRegion': row.key[0],
+            'Deployed': bool(row.deployed >> position & 1),
+            'MissingRegions': sorted(region for region in row.target_regions if not row.region_bits.get(region, 0) >> position & 1),
+            'Failed': bool(row.failed >> position & 1),
+            'Drifted': bool(row.drifted >> position & 1),
+        } for row in rows]
+
+coverage_matrix = None
+coverage_flights = SingleFlight('coverage')
+
+def load_coverage_row(matrix, key, force_refresh=False):
+    stack_set_region, stack_set_name = key
+    row = matrix.rows.get(key)
+    generation = inventory_cache.generation(key)
+    if (row and not force_refresh and row.generation == generation and inventory_cache.peek(key) is None
+            and time.monotonic() - row.built_at < inventory_cache.ttl):
+        # StackSet数量超过缓存条目上限时索引会被LRU淘汰；行未失效且未过期时直接沿用，不重新拉取
+        return row
+    stack_set_info = get_stack_set(stack_set_name, stack_set_region, force_refresh=force_refresh)
+    index = get_instance_index(stack_set_name, stack_set_region, force_refresh=force_refresh)
+    if row and row.index() is index and row.stack_set_info == stack_set_info:
+        return row
+    return matrix.build_row(key, generation, stack_set_info, index)
+
+def build_coverage_matrix(force_refresh):
+    # 组织账户未变化时沿用已有的行，只重新计算实例缓存变化的StackSet
+    global coverage_matrix
+    matrix = CoverageMatrix(get_organization_model(force_refresh=force_refresh))
+    if coverage_matrix is not None and matrix.same_accounts(coverage_matrix):
+        matrix.rows = coverage_matrix.rows
+    futures = {key: stack_set_executor.submit(load_coverage_row, matrix, key, force_refresh)
+               for key in list_all_stack_sets(cached=not force_refresh)}
+    rows, errors = {}, []
+    for (stack_set_region, stack_set_name), future in futures.items():
+        try:
+            rows[(stack_set_region, stack_set_name)] = future.result()
+        except Exception as e:
+            logger.error(f"获取StackSet {stack_set_name} ({stack_set_region}) 实例时出错: {str(e)}", exc_info=True)
+            errors.append({'StackSetName': stack_set_name, 'StackSetRegion': stack_set_region, 'Error': str(e)})
+    matrix.rows = rows
+    matrix.errors = errors
+    coverage_matrix = matrix
+    return matrix
+
+def get_coverage_matrix(force_refresh=False):
+    # 已构建的矩阵仍有效时直接返回，否则重新构建；并发请求共享同一次构建
+    matrix = coverage_matrix
+    if not force_refresh and matrix is not None and matrix.is_current():
+        return matrix
+    return coverage_flights.do(force_refresh, lambda: build_coverage_matrix(force_refresh))
+
+EXPORT_FIELDS = [
+    'StackSetName', 'StackSetRegion', 'Account', 'AccountName', 'AccountStatus', 'OrganizationalUnitId',
+    'OrganizationalUnitPath', 'Region', 'DetailedStatus', 'DriftStatus',
+]
+
+# 格式: (Content-Type, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+EXPORT_BATCH_SIZE = 5000
+
+def select_stack_set_keys(patterns=()):
+    stack_set_keys = list_all_stack_sets()
+    if patterns:
+        stack_set_keys = [(region, name) for region, name in stack_set_keys if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+    return stack_set_keys
+
+def iter_export_rows(stack_set_keys, filters=None, force_refresh=False, errors=None):
+    # 逐个StackSet从缓存的索引按需生成记录，同时在后台加载下一个StackSet；内存占用与导出的总行数无关。
+    # 加载失败的StackSet跳过并记录到errors；未传入errors时在最后一行之后抛出异常，使输出不完整（客户端可以发现）
+    organization_model = get_organization_model()
+    ou_paths = {}
+    failed = [] if errors is None else errors
+    load = lambda key: get_instance_index(key[1], key[0], force_refresh=force_refresh)
+    stack_set_keys = list(stack_set_keys)
+    next_future = stack_set_executor.submit(load, stack_set_keys[0]) if stack_set_keys else None
+    for position, (stack_set_region, stack_set_name) in enumerate(stack_set_keys):
+        try:
+            index = next_future.result()
+        except Exception as e:
+            logger.error(f"导出时获取StackSet {stack_set_name} ({stack_set_region}) 实例出错: {str(e)}", exc_info=True)
+            failed.append({'StackSetName': stack_set_name, 'StackSetRegion': stack_set_region, 'Error': str(e)})
+            index = None
+        if position + 1 < len(stack_set_keys):
+            next_future = stack_set_executor.submit(load, stack_set_keys[position + 1])
+        if index is None:
+            continue
+        for instance in index.query(**(filters or {})):
+            account = organization_model.accounts.get(instance['Account'], {})
+            ou_id = instance['OrganizationalUnitId']
+            if ou_id not in ou_paths:
+                ou_paths[ou_id] = '/'.join(ou['Name'] for ou in organization_model.get_ou_path(ou_id))
+            yield {
                 'StackSetName': stack_set_name,
-                'AutoDeployment': auto_deployment,
-                'TotalInstances': total_instances,
-                'InSync': in_sync,
-                'Drifted': drifted,
-                'Succeeded': succeeded,
-                'Failed': failed,
-                'SkippedSuspendedAccount': skipped_suspended_account,
-                'NotDeployedAccounts': len(not_deployed_accounts),
-                'NotDeployedAccountDetails': not_deployed_accounts
-            })
+                'StackSetRegion': stack_set_region,
+                'Account': instance['Account'],
+                'AccountName': account.get('Name'),
+                'AccountStatus': get_account_status(account),
+                'OrganizationalUnitId': ou_id,
+                'OrganizationalUnitPath': ou_paths[ou_id],
+                'Region': instance['Region'],
+                'DetailedStatus': instance['DetailedStatus'],
+                'DriftStatus': instance['DriftStatus'],
+            }
+    if failed and errors is None:
+        raise RuntimeError(f"Export incomplete: failed to load {len(failed)} StackSets: "
+                           + ', '.join(f"{error['StackSetName']} ({error['StackSetRegion']})" for error in failed))
+
+def iter_batches(rows, size=EXPORT_BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def encode_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def encode_ndjson(batches):
+    for batch in batches:
+        yield ''.join(json.dumps(row, default=str) + '\n' for row in batch).encode()
+
+class ExportSink(io.RawIOBase):
+    # 供ParquetWriter写入的只追加缓冲区，每写完一个行组取出已写入的字节
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def encode_parquet(batches, compression):
+    # 每个批次写为一个行组
+    schema = pyarrow.schema([(field, pyarrow.string()) for field in EXPORT_FIELDS])
+    sink = ExportSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for batch in batches:
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def iter_export(export_format, stack_set_keys, filters=None, compress=False, force_refresh=False, errors=None):
+    # 返回字节块生成器；Parquet使用自带的gzip压缩，其他格式整体gzip压缩。errors的含义见iter_export_rows
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format: {export_format}")
+    if export_format == 'parquet' and pyarrow is None:
+        raise ValueError('Parquet export requires pyarrow.')
+    batches = iter_batches(iter_export_rows(stack_set_keys, filters, force_refresh, errors))
+    if export_format == 'parquet':
+        return encode_parquet(batches, 'gzip' if compress else 'snappy')
+    chunks = encode_csv(batches) if export_format == 'csv' else encode_ndjson(batches)
+    return gzip_chunks(chunks) if compress else chunks
+
+def export_filename(export_format, compress):
+    extension = EXPORT_FORMATS[export_format][1]
+    if compress and export_format != 'parquet':
+        extension += '.gz'
+    return f"stackset-instances-{datetime.datetime.now().strftime('%Y%m%dT%H%M%S')}.{extension}"
+
+@app.route('/')
+def list_stacksets():
+    # refresh参数强制跳过缓存；stream参数控制是否流式渲染
+    force_refresh = request.args.get('refresh', 'false').lower() == 'true'
+    stream = request.args.get('stream', str(dashboard_streaming)).lower() == 'true'
+    streaming_headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        logger.info("处理请求: 以NDJSON流式返回所有StackSets")
+        return Response(stream_with_context(stream_stack_set_details_ndjson(force_refresh)),
+                        mimetype='application/x-ndjson', headers=streaming_headers)
+    
+    if stream:
+        logger.info("处理请求: 流式渲染所有StackSets")
+        return Response(stream_template('list_stacksets.html', stack_set_details_list=stream_stack_set_rows(force_refresh), streaming=True),
+                        headers=streaming_headers)
+    
+    try:
+        logger.info("处理请求: 列出所有StackSets")
+        stack_set_details_list = list(iter_stack_set_details(force_refresh=force_refresh, ordered=True))
         
+        with server_timing('render'):
+            html = render_template('list_stacksets.html', stack_set_details_list=stack_set_details_list, streaming=False)
         logger.info("成功渲染StackSets列表页面")
-        return render_template('list_stacksets.html', stack_set_details_list=stack_set_details_list)
+        return html
     except Exception as e:
         logger.error(f"列出StackSets时出错: {str(e)}", exc_info=True)
         return f"An error occurred: {str(e)}"
 
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # 在响应体发送完成后记录耗时，流式响应也能统计完整时长
+    started_at = g.get('request_started_at', time.perf_counter())
+    labels = {'route': request.url_rule.rule if request.url_rule else 'unmatched', 'method': request.method,
+              'status': str(response.status_code)}
+
+    def record():
+        metrics.inc('http_requests_total', labels)
+        metrics.observe('http_request_duration_seconds', labels, time.perf_counter() - started_at)
+
+    response.call_on_close(record)
+    if g.get('server_timing') and not response.is_streamed:
+        response.headers['Server-Timing'] = ', '.join(f'{name};dur={duration * 1000:.1f}' for name, duration in g.server_timing)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # 缓存、令牌桶和任务状态在抓取时计算
+    gauges = []
+    for cache in (inventory_cache, stack_set_cache, organization_cache):
+        gauges.append(('inventory_cache_entries', {'cache': cache.name}, len(cache.entries)))
+        gauges.append(('inventory_cache_bytes', {'cache': cache.name}, cache.total_size))
+    with token_buckets_lock:
+        for key, bucket in token_buckets.items():
+            service_name, region_name = key or ('unknown', 'unknown')
+            gauges.append(('aws_api_rate_limit', {'service': service_name, 'region': region_name}, round(bucket.rate, 3)))
+    job_statuses = {}
+    for job in job_manager.list():
+        job_statuses[job.status] = job_statuses.get(job.status, 0) + 1
+    gauges.extend(('jobs', {'status': status}, count) for status, count in job_statuses.items())
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/add_undeployed_accounts', methods=['POST'])
 def add_undeployed_accounts():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     dry_run = data.get('dryRun', False)
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 添加未部署账户到StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}, 干运行: {dry_run}")
     
     try:
-        # Retrieve organization accounts
-        organization_accounts = get_organization_accounts()
-        organization_account_ids = {account['Id'] for account in organization_accounts}
-
-        # Retrieve root OU ID
-        root_ou_id = get_organization_root_ou_id()
-        logger.info(f"获取组织根OU ID: {root_ou_id}")
-
-        # List stack instances to get deployed accounts
-        instances = get_stack_instances(stack_set_name)
-        deployed_account_ids = {instance['Account'] for instance in instances}
-
-        # Calculate undeployed account IDs
-        undeployed_account_ids = organization_account_ids - deployed_account_ids - ignore_accounts
-        undeployed_account_details = [account for account in organization_accounts if account['Id'] in undeployed_account_ids]
+        # Calculate undeployed (account, region) pairs under their real parent OU
+        undeployed_account_details, targets = plan_stack_set_action('add_undeployed_accounts', stack_set_name, stack_set_region, ignore_accounts)
         
         logger.info(f"未部署账户数: {len(undeployed_account_details)}")
         
+        if not undeployed_account_details:
+            return jsonify({'message': 'No undeployed accounts found.'})
+        
         # Dry run response
         if dry_run:
             logger.info(f"干运行结束，发现 {len(undeployed_account_details)} 个未部署账户")
             return jsonify({'message': 'Dry run: following accounts would be added', 'accounts': undeployed_account_details})
         
-        # Add undeployed accounts
-        for account in undeployed_account_details:
-            logger.info(f"添加账户 {account['Id']} ({account['Name']}) 到 StackSet {stack_set_name}")
-            cloudformation_client.create_stack_instances(
-                StackSetName=stack_set_name,
-                DeploymentTargets={
-                    'Accounts': [account['Id']],
-                    'OrganizationalUnitIds': [root_ou_id],
-                    'AccountFilterType': 'INTERSECTION'
-                },
-                Regions=[aws_region],
-                CallAs='DELEGATED_ADMIN'
-            )
-        
-        logger.info(f"成功添加 {len(undeployed_account_details)} 个未部署账户到 StackSet {stack_set_name}")
-        return jsonify({'message': 'Undeployed accounts added successfully.', 'accounts': undeployed_account_details})
+        # Add undeployed accounts in as few operations as possible
+        job = submit_stack_set_action('add_undeployed_accounts', stack_set_name, stack_set_region, targets,
+                                      get_operation_preferences(data.get('operationPreferences')))
+        
+        logger.info(f"已提交任务 {job.id}: 添加 {len(undeployed_account_details)} 个未部署账户到 StackSet {stack_set_name}")
+        return jsonify({'message': 'Adding undeployed accounts.', 'accounts': undeployed_account_details, 'jobId': job.id}), 202
     except Exception as e:
         logger.error(f"添加未部署账户时出错: {str(e)}", exc_info=True)
         return jsonify({'message': str(e)}), 500
 
-def get_organization_root_ou_id():
+@app.route('/get_not_deployed_accounts', methods=['POST'])
+def get_not_deployed_accounts():
+    data = request.get_json()
+    stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
+    ignore_accounts = set(data.get('ignoreAccounts', []))
+    
+    logger.info(f"处理请求: 获取未部署账户 StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}")
+    
     try:
-        logger.info("获取组织根OU ID")
-        response = organizations_client.list_roots()
-        root_ou_id = response['Roots'][0]['Id']
-        return root_ou_id
+        directory = get_account_directory()
+        undeployed_regions = get_undeployed_regions(stack_set_name, stack_set_region, directory.keys() - ignore_accounts)
+        accounts = sorted(({**directory[account_id], 'MissingRegions': regions} for account_id, regions in undeployed_regions.items()),
+                          key=lambda x: x['Name'])
+        
+        logger.info(f"发现 {len(accounts)} 个未部署账户")
+        
+        if not accounts:
+            return jsonify({'message': 'No undeployed accounts found.'})
+        
+        return jsonify({'accounts': accounts})
     except Exception as e:
-        logger.error(f"获取组织根OU ID时出错: {str(e)}", exc_info=True)
-        raise Exception(f"Failed to retrieve organization root OU ID: {str(e)}")
+        logger.error(f"获取未部署账户时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
 
 @app.route('/remove_suspended_accounts', methods=['POST'])
 def remove_suspended_accounts():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     dry_run = data.get('dryRun', False)
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 移除暂停账户从StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}, 干运行: {dry_run}")
     
     try:
-        instances = get_stack_instances(stack_set_name)
-        
-        outdated_instances = [
-            {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
-            for instance in instances if instance['StackInstanceStatus']['DetailedStatus'] == 'SKIPPED_SUSPENDED_ACCOUNT' and instance['Account'] not in ignore_accounts
-        ]
-        
-        logger.info(f"发现 {len(outdated_instances)} 个潜在的暂停账户实例")
-        
-        account_statuses = {}
-        for instance in outdated_instances[:]:
-            account_id = instance['Account']
-            if account_id in ignore_accounts:
-                continue
-            try:
-                account_status = organizations_client.describe_account(AccountId=account_id)['Account']['Status']
-                logger.info(f"账户 {account_id} 状态: {account_status}")
-                if account_status != 'SUSPENDED':
-                    outdated_instances.remove(instance)
-            except Exception as e:
-                logger.warning(f"无法获取账户 {account_id} 状态，可能已被删除: {str(e)}")
-                account_status = 'Deleted'
-            account_statuses[account_id] = account_status
+        outdated_instances, targets = plan_stack_set_action('remove_suspended_accounts', stack_set_name, stack_set_region, ignore_accounts)
         
         if not outdated_instances:
             logger.info("未找到暂停账户")
             return jsonify({'message': 'No suspended accounts found.'})
         
-        # Combine instances with the same OrganizationalUnitId and Region
-        combined_instances = {}
-        for instance in outdated_instances:
-            key = (instance['OrganizationalUnitId'], instance['Region'])
-            instance['Status']=account_statuses[instance['Account']]
-            if key not in combined_instances:
-                combined_instances[key] = []
-            combined_instances[key].append(instance)
+        if dry_run:
+            logger.info(f"干运行结束，发现 {len(outdated_instances)} 个要移除的暂停账户实例")
+            return jsonify({'message': 'Dry run: following accounts would be removed', 'accounts': outdated_instances})
         
+        # Combine instances with the same OrganizationalUnitId and Region into as few operations as possible
         logger.info(f"将移除 {len(outdated_instances)} 个暂停账户实例")
+        job = submit_stack_set_action('remove_suspended_accounts', stack_set_name, stack_set_region, targets,
+                                      get_operation_preferences(data.get('operationPreferences')))
         
-        for (ou_id, region), accounts in combined_instances.items():
-            if dry_run:
-                logger.info(f"干运行结束，发现 {len(accounts)} 个要移除的暂停账户")
-                return jsonify({'message': 'Dry run: following accounts would be removed', 'accounts': accounts})
-            else:
-                logger.info(f"移除 {len(accounts)} 个暂停账户从OU {ou_id}, 区域 {region}")
-                cloudformation_client.delete_stack_instances(
-                    StackSetName=stack_set_name,
-                    DeploymentTargets={
-                        'Accounts': [account['Account'] for account in accounts],
-                        'OrganizationalUnitIds': [ou_id],
-                        'AccountFilterType': 'INTERSECTION',
-                    },
-                    Regions=[region],
-                    RetainStacks=True,
-                    CallAs='DELEGATED_ADMIN'
-                )
-        
-                logger.info(f"成功移除暂停账户")
-                return jsonify({'message': 'Suspended accounts removed successfully.'})
+        logger.info(f"已提交任务 {job.id}: 移除暂停账户")
+        return jsonify({'message': 'Removing suspended accounts.', 'accounts': outdated_instances, 'jobId': job.id}), 202
     except Exception as e:
         logger.error(f"移除暂停账户时出错: {str(e)}", exc_info=True)
         return jsonify({'message': str(e)}), 500
@@ -293,18 +2237,14 @@ def remove_suspended_accounts():
 def retry_failed_instances():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     dry_run = data.get('dryRun', False)
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 重试失败实例 StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}, 干运行: {dry_run}")
     
     try:
-        instances = get_stack_instances(stack_set_name)
-        
-        failed_instances = [
-            {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
-            for instance in instances if instance['StackInstanceStatus']['DetailedStatus'] == 'FAILED' and instance['Account'] not in ignore_accounts
-        ]
+        failed_instances, targets = plan_stack_set_action('retry_failed_instances', stack_set_name, stack_set_region, ignore_accounts)
         
         logger.info(f"发现 {len(failed_instances)} 个失败实例")
         
@@ -316,20 +2256,10 @@ def retry_failed_instances():
             logger.info(f"干运行结束，发现 {len(failed_instances)} 个要重试的失败实例")
             return jsonify({'message': 'Dry run: following instances would be retried', 'instances': failed_instances})
         
-        for instance in failed_instances:
-            logger.info(f"重试失败实例: 账户 {instance['Account']}, 区域 {instance['Region']}")
-            cloudformation_client.update_stack_instances(
-                StackSetName=stack_set_name,
-                DeploymentTargets={
-                    'Accounts': [instance['Account']],
-                    'OrganizationalUnitIds': [instance['OrganizationalUnitId']],
-                    'AccountFilterType': 'INTERSECTION',
-                },
-                Regions=[instance['Region']],
-                CallAs='DELEGATED_ADMIN'
-            )
-        logger.info(f"已成功重试 {len(failed_instances)} 个失败实例")
-        return jsonify({'message': 'Failed instances retried successfully.', 'instances': failed_instances})
+        job = submit_stack_set_action('retry_failed_instances', stack_set_name, stack_set_region, targets,
+                                      get_operation_preferences(data.get('operationPreferences')))
+        logger.info(f"已提交任务 {job.id}: 重试 {len(failed_instances)} 个失败实例")
+        return jsonify({'message': 'Retrying failed instances.', 'instances': failed_instances, 'jobId': job.id}), 202
     except Exception as e:
         logger.error(f"重试失败实例时出错: {str(e)}", exc_info=True)
         return jsonify({'message': str(e)}), 500
@@ -338,18 +2268,14 @@ def retry_failed_instances():
 def retry_drifted_instances():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     dry_run = data.get('dryRun', False)
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 重试偏差实例 StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}, 干运行: {dry_run}")
     
     try:
-        instances = get_stack_instances(stack_set_name)
-        
-        drifted_instances = [
-            {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
-            for instance in instances if instance['DriftStatus'] == 'DRIFTED' and instance['Account'] not in ignore_accounts
-        ]
+        drifted_instances, targets = plan_stack_set_action('retry_drifted_instances', stack_set_name, stack_set_region, ignore_accounts)
         
         logger.info(f"发现 {len(drifted_instances)} 个偏差实例")
         
@@ -361,20 +2287,10 @@ def retry_drifted_instances():
             logger.info(f"干运行结束，发现 {len(drifted_instances)} 个要重试的偏差实例")
             return jsonify({'message': 'Dry run: following instances would be retried', 'instances': drifted_instances})
         
-        for instance in drifted_instances:
-            logger.info(f"重试偏差实例: 账户 {instance['Account']}, 区域 {instance['Region']}")
-            cloudformation_client.update_stack_instances(
-                StackSetName=stack_set_name,
-                DeploymentTargets={
-                    'Accounts': [instance['Account']],
-                    'OrganizationalUnitIds': [instance['OrganizationalUnitId']],
-                    'AccountFilterType': 'INTERSECTION',
-                },
-                Regions=[instance['Region']],
-                CallAs='DELEGATED_ADMIN'
-            )
-        logger.info(f"已成功重试 {len(drifted_instances)} 个偏差实例")
-        return jsonify({'message': 'Drifted instances retried successfully.', 'instances': drifted_instances})
+        job = submit_stack_set_action('retry_drifted_instances', stack_set_name, stack_set_region, targets,
+                                      get_operation_preferences(data.get('operationPreferences')))
+        logger.info(f"已提交任务 {job.id}: 重试 {len(drifted_instances)} 个偏差实例")
+        return jsonify({'message': 'Retrying drifted instances.', 'instances': drifted_instances, 'jobId': job.id}), 202
     except Exception as e:
         logger.error(f"重试偏差实例时出错: {str(e)}", exc_info=True)
         return jsonify({'message': str(e)}), 500
@@ -383,17 +2299,13 @@ def retry_drifted_instances():
 def get_in_sync_instances():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 获取同步实例 StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}")
     
     try:
-        instances = get_stack_instances(stack_set_name)
-        
-        in_sync_instances = [
-            {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
-            for instance in instances if instance['DriftStatus'] == 'IN_SYNC' and instance['Account'] not in ignore_accounts
-        ]
+        in_sync_instances = query_instances(stack_set_name, stack_set_region, ignore_accounts=ignore_accounts, drift=['IN_SYNC'])
         
         logger.info(f"发现 {len(in_sync_instances)} 个同步实例")
         
@@ -410,17 +2322,13 @@ def get_in_sync_instances():
 def get_drifted_instances():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 获取偏差实例 StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}")
     
     try:
-        instances = get_stack_instances(stack_set_name)
-        
-        drifted_instances = [
-            {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
-            for instance in instances if instance['DriftStatus'] == 'DRIFTED' and instance['Account'] not in ignore_accounts
-        ]
+        drifted_instances = query_instances(stack_set_name, stack_set_region, ignore_accounts=ignore_accounts, drift=['DRIFTED'])
         
         logger.info(f"发现 {len(drifted_instances)} 个偏差实例")
         
@@ -437,17 +2345,13 @@ def get_drifted_instances():
 def get_succeeded_instances():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 获取成功实例 StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}")
     
     try:
-        instances = get_stack_instances(stack_set_name)
-        
-        succeeded_instances = [
-            {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
-            for instance in instances if instance['StackInstanceStatus']['DetailedStatus'] == 'SUCCEEDED' and instance['Account'] not in ignore_accounts
-        ]
+        succeeded_instances = query_instances(stack_set_name, stack_set_region, ignore_accounts=ignore_accounts, status=['SUCCEEDED'])
         
         logger.info(f"发现 {len(succeeded_instances)} 个成功实例")
         
@@ -464,17 +2368,13 @@ def get_succeeded_instances():
 def get_failed_instances():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 获取失败实例 StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}")
     
     try:
-        instances = get_stack_instances(stack_set_name)
-        
-        failed_instances = [
-            {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
-            for instance in instances if instance['StackInstanceStatus']['DetailedStatus'] == 'FAILED' and instance['Account'] not in ignore_accounts
-        ]
+        failed_instances = query_instances(stack_set_name, stack_set_region, ignore_accounts=ignore_accounts, status=['FAILED'])
         
         logger.info(f"发现 {len(failed_instances)} 个失败实例")
         
@@ -491,17 +2391,13 @@ def get_failed_instances():
 def get_skipped_suspended_account_instances():
     data = request.get_json()
     stack_set_name = data['stackSetName']
+    stack_set_region = data.get('stackSetRegion')
     ignore_accounts = set(data.get('ignoreAccounts', []))
     
     logger.info(f"处理请求: 获取跳过/暂停账户实例 StackSet {stack_set_name}, 忽略账户数: {len(ignore_accounts)}")
     
     try:
-        instances = get_stack_instances(stack_set_name)
-        
-        skipped_suspended_account_instances = [
-            {'Account': instance['Account'], 'Region': instance['Region'], 'OrganizationalUnitId': instance['OrganizationalUnitId']}
-            for instance in instances if instance['StackInstanceStatus']['DetailedStatus'] == 'SKIPPED_SUSPENDED_ACCOUNT' and instance['Account'] not in ignore_accounts
-        ]
+        skipped_suspended_account_instances = query_instances(stack_set_name, stack_set_region, ignore_accounts=ignore_accounts, status=['SKIPPED_SUSPENDED_ACCOUNT'])
         
         logger.info(f"发现 {len(skipped_suspended_account_instances)} 个跳过/暂停账户实例")
         
@@ -514,6 +2410,204 @@ def get_skipped_suspended_account_instances():
         logger.error(f"获取跳过/暂停账户实例时出错: {str(e)}", exc_info=True)
         return jsonify({'message': str(e)}), 500
 
+@app.route('/detect_drift', methods=['POST'])
+def detect_drift():
+    # stackSetNames为空时对所有主区域中的全部StackSet进行漂移检测
+    data = request.get_json() or {}
+    stack_set_names = data.get('stackSetNames') or []
+    stack_set_region = data.get('stackSetRegion')
+    dry_run = data.get('dryRun', False)
+    
+    logger.info(f"处理请求: 漂移检测 StackSets: {stack_set_names or '全部'}, 干运行: {dry_run}")
+    
+    try:
+        if stack_set_names:
+            stack_set_keys = [stack_set_key(stack_set_name, stack_set_region) for stack_set_name in stack_set_names]
+        else:
+            stack_set_keys = list_all_stack_sets()
+        stack_sets = [{'StackSetName': stack_set_name, 'StackSetRegion': region} for region, stack_set_name in stack_set_keys]
+        
+        if not stack_sets:
+            return jsonify({'message': 'No StackSets found.'})
+        
+        if dry_run:
+            logger.info(f"干运行结束，将对 {len(stack_sets)} 个StackSet进行漂移检测")
+            return jsonify({'message': 'Dry run: drift detection would run on following StackSets', 'stackSets': stack_sets})
+        
+        job = job_manager.submit('DETECT_DRIFT', ','.join(stack_set_names) or '*', run_drift_detection_job, stack_set_keys,
+                                 get_operation_preferences(data.get('operationPreferences')),
+                                 stack_set_region=stack_set_region, total=len(stack_set_keys))
+        logger.info(f"已提交任务 {job.id}: 对 {len(stack_sets)} 个StackSet进行漂移检测")
+        return jsonify({'message': 'Detecting drift.', 'stackSets': stack_sets, 'jobId': job.id}), 202
+    except Exception as e:
+        logger.error(f"漂移检测时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    jobs = sorted(job_manager.list(), key=lambda job: job.created_at, reverse=True)
+    return jsonify([job.to_dict() for job in jobs])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'message': f'Job {job_id} not found.'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'message': f'Job {job_id} not found.'}), 404
+
+    def generate():
+        # Server-Sent Events：任务每次更新推送一次快照，任务结束后关闭
+        version = -1
+        while True:
+            with job.condition:
+                job.condition.wait_for(lambda: job.version != version, timeout=15)
+                changed = job.version != version
+                version = job.version
+            if changed:
+                yield f"data: {json.dumps(job.to_dict(), default=str)}\n\n"
+                if job.finished:
+                    return
+            else:
+                yield ": keepalive\n\n"
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/stacksets/<stack_set_name>/instances', methods=['GET'])
+def query_stack_set_instances(stack_set_name):
+    filters = {field: request.args.get(field, '').split(',') if request.args.get(field) else None
+               for field in InstanceIndex.FIELDS}
+    ignore_accounts = set(filter(None, request.args.get('ignoreAccounts', '').split(',')))
+    stack_set_region = request.args.get('stackSetRegion')
+    
+    logger.info(f"处理请求: 查询实例 StackSet {stack_set_name}, 过滤条件: { {k: v for k, v in filters.items() if v} }")
+    
+    try:
+        index = get_instance_index(stack_set_name, stack_set_region)
+        instances = list(index.query(ignore_accounts=ignore_accounts, **filters))
+        logger.info(f"查询到 {len(instances)} 个实例")
+        return jsonify({'instances': instances, 'count': len(instances),
+                        'counts': {field: index.counts[field] for field in ('status', 'drift')}})
+    except Exception as e:
+        logger.error(f"查询实例时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+
+@app.route('/api/stacksets/<stack_set_name>/snapshots', methods=['GET'])
+def list_stack_set_snapshots(stack_set_name):
+    stack_set_region = request.args.get('stackSetRegion')
+    
+    if not snapshot_store:
+        return jsonify({'message': 'Snapshot store is disabled.'}), 404
+    try:
+        return jsonify({'snapshots': snapshot_store.list_snapshots('instances', stack_set_key(stack_set_name, stack_set_region))})
+    except Exception as e:
+        logger.error(f"列出快照时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+
+@app.route('/api/stacksets/<stack_set_name>/changes', methods=['GET'])
+def get_stack_set_changes(stack_set_name):
+    # since为ISO 8601时间，默认为24小时前；只读取本地快照，不调用AWS
+    stack_set_region = request.args.get('stackSetRegion')
+    since = request.args.get('since')
+    
+    logger.info(f"处理请求: 对比StackSet {stack_set_name} 快照, since: {since}")
+    
+    if not snapshot_store:
+        return jsonify({'message': 'Snapshot store is disabled.'}), 404
+    try:
+        since_timestamp = datetime.datetime.fromisoformat(since).timestamp() if since else time.time() - 86400
+    except ValueError:
+        return jsonify({'message': f'Invalid since: {since}'}), 400
+    try:
+        changes = snapshot_store.diff_instances(stack_set_key(stack_set_name, stack_set_region), since_timestamp)
+        if changes is None:
+            return jsonify({'message': 'No snapshots found.'}), 404
+        logger.info(f"快照对比结果: 新增失败 {len(changes['NewFailed'])}, 新增漂移 {len(changes['NewlyDrifted'])}")
+        return jsonify(changes)
+    except Exception as e:
+        logger.error(f"对比快照时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+
+@app.route('/api/coverage', methods=['GET'])
+def get_coverage():
+    # state为missing、failed或drifted；返回在至少minCount个所选StackSet中处于该状态的账户
+    patterns = [pattern for pattern in request.args.get('stackSets', '').split(',') if pattern]
+    state = request.args.get('state', 'missing')
+    ignore_accounts = set(filter(None, request.args.get('ignoreAccounts', '').split(',')))
+    force_refresh = request.args.get('refresh', 'false').lower() == 'true'
+    
+    logger.info(f"处理请求: 账户覆盖矩阵, StackSets: {patterns or '全部'}, 状态: {state}")
+    
+    if state not in CoverageMatrix.STATES:
+        return jsonify({'message': f'Invalid state: {state}'}), 400
+    try:
+        min_count = int(request.args.get('minCount', '1'))
+    except ValueError:
+        return jsonify({'message': 'minCount must be an integer.'}), 400
+    try:
+        started_at = time.perf_counter()
+        matrix = get_coverage_matrix(force_refresh=force_refresh)
+        rows = matrix.select(patterns)
+        gaps = matrix.gaps(rows, state, min_count, ignore_accounts)
+        stack_sets = matrix.summary(rows)
+        logger.info(f"覆盖矩阵查询: {len(rows)} 个StackSet, {len(gaps)} 个账户, 耗时 {(time.perf_counter() - started_at) * 1000:.1f}ms")
+        return jsonify({'accounts': gaps, 'count': len(gaps), 'stackSets': stack_sets, 'totalAccounts': len(matrix.account_ids),
+                        'state': state, 'minCount': min_count, 'errors': matrix.errors})
+    except Exception as e:
+        logger.error(f"查询账户覆盖矩阵时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+
+@app.route('/api/accounts/<account_id>/coverage', methods=['GET'])
+def get_account_coverage(account_id):
+    patterns = [pattern for pattern in request.args.get('stackSets', '').split(',') if pattern]
+    
+    logger.info(f"处理请求: 账户 {account_id} 的StackSet覆盖情况")
+    
+    try:
+        matrix = get_coverage_matrix()
+        if account_id not in matrix.account_positions:
+            return jsonify({'message': f'Account {account_id} not found in the organization.'}), 404
+        account = matrix.organization_model.accounts[account_id]
+        stack_sets = matrix.account(account_id, matrix.select(patterns))
+        return jsonify({'Account': account_id, 'Name': account.get('Name'), 'Status': get_account_status(account),
+                        'OrganizationalUnitId': matrix.organization_model.get_parent_id(account_id),
+                        'stackSets': stack_sets, 'errors': matrix.errors})
+    except Exception as e:
+        logger.error(f"查询账户覆盖情况时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+
+@app.route('/export', methods=['GET'])
+def export_instances():
+    # 以流的形式导出所有StackSet的实例；format为csv、ndjson或parquet，gzip=true时压缩
+    export_format = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', 'false').lower() == 'true'
+    patterns = [pattern for pattern in request.args.get('stackSets', '').split(',') if pattern]
+    filters = {field: request.args[field].split(',') for field in ('status', 'drift', 'region', 'ou', 'account') if request.args.get(field)}
+    force_refresh = request.args.get('refresh', 'false').lower() == 'true'
+    
+    logger.info(f"处理请求: 导出实例, 格式: {export_format}, gzip: {compress}, StackSets: {patterns or '全部'}, 过滤条件: {filters}")
+    
+    try:
+        chunks = iter_export(export_format, select_stack_set_keys(patterns), filters, compress, force_refresh)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"导出实例时出错: {str(e)}", exc_info=True)
+        return jsonify({'message': str(e)}), 500
+    mimetype = 'application/gzip' if compress and export_format != 'parquet' else EXPORT_FORMATS[export_format][0]
+    headers = {'Content-Disposition': f'attachment; filename="{export_filename(export_format, compress)}"',
+               'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+@app.route('/coverage')
+def coverage_page():
+    return render_template('coverage.html')
+
 if __name__ == '__main__':
     start_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     logger.info(f"应用启动时间: {start_time}")
@@ -0,0 +1,541 @@
+"""Offline benchmark for cfn-stackset-powertools.
+
+Replaces the CloudFormation and Organizations clients with a synthetic fleet
+and measures the Flask endpoints without an AWS account:
+
+    python bench.py --preset small
+    python bench.py --preset large --latency-ms 50 --throttle 0.02
+    python bench.py --preset small --save-baseline bench_baseline.json
+    python bench.py --preset small --baseline bench_baseline.json   # exit 1 on regressions
+    python bench.py --preset large --index-memory 1000000           # cached instance memory
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import uuid
+
+from botocore.exceptions import ClientError
+
+REGIONS = [
+    'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1', 'sa-east-1',
+    'eu-west-1', 'eu-west-2', 'eu-west-3', 'eu-central-1', 'eu-north-1', 'eu-south-1',
+    'ap-northeast-1', 'ap-northeast-2', 'ap-northeast-3', 'ap-southeast-1', 'ap-southeast-2',
+    'ap-south-1', 'me-south-1', 'af-south-1', 'ap-east-1', 'eu-central-2',
+]
+
+PRESETS = {
+    'small': {'accounts': 300, 'stack_sets': 20, 'regions': 4, 'home_regions': 1},
+    'medium': {'accounts': 1500, 'stack_sets': 60, 'regions': 10, 'home_regions': 2},
+    'large': {'accounts': 5000, 'stack_sets': 200, 'regions': 20, 'home_regions': 2},
+}
+
+# 与AWS API一致的分页大小
+ACCOUNTS_PAGE_SIZE = 20
+CHILDREN_PAGE_SIZE = 20
+STACK_SETS_PAGE_SIZE = 100
+STACK_INSTANCES_PAGE_SIZE = 100
+ACCOUNTS_PER_OU = 250
+
+
+class SyntheticFleet:
+    # 确定性生成的组织和StackSet：实例在分页请求时按位置计算，不在内存中保存完整列表
+    def __init__(self, accounts, stack_sets, regions, home_regions):
+        self.regions = REGIONS[:regions]
+        self.home_regions = REGIONS[:home_regions]
+        self.root_id = 'r-bench'
+        self.ou_ids = [f'ou-bench-{j:08x}' for j in range(max(1, accounts // ACCOUNTS_PER_OU))]
+        self.accounts = [{
+            'Id': str(100000000000 + i),
+            'Arn': f'arn:aws:organizations::100000000000:account/o-bench/{100000000000 + i}',
+            'Email': f'bench+{i}@example.com',
+            'Name': f'bench-account-{i:05d}',
+            'Status': 'SUSPENDED' if i % 97 == 96 else 'ACTIVE',
+            'JoinedMethod': 'CREATED',
+        } for i in range(accounts)]
+        self.stack_sets = []
+        for s in range(stack_sets):
+            region_count = 1 + s % min(4, len(self.regions))
+            start = (s * 7) % len(self.regions)
+            self.stack_sets.append({
+                'StackSetName': f'bench-stackset-{s:04d}',
+                'StackSetId': f'bench-stackset-{s:04d}:{uuid.UUID(int=s)}',
+                'HomeRegion': self.home_regions[s % len(self.home_regions)],
+                'Regions': [self.regions[(start + r) % len(self.regions)] for r in range(region_count)],
+                # 约2%的账户未部署
+                'AccountIndexes': [i for i in range(accounts) if (i + s) % 50 != 0],
+                'Index': s,
+            })
+
+    def get_parent_id(self, account_index):
+        return self.ou_ids[account_index % len(self.ou_ids)]
+
+    def stack_sets_in(self, home_region):
+        return [stack_set for stack_set in self.stack_sets if stack_set['HomeRegion'] == home_region]
+
+    def instance_count(self, stack_set):
+        return len(stack_set['AccountIndexes']) * len(stack_set['Regions'])
+
+    def instance(self, stack_set, position):
+        account_index = stack_set['AccountIndexes'][position // len(stack_set['Regions'])]
+        region_index = position % len(stack_set['Regions'])
+        account = self.accounts[account_index]
+        region = stack_set['Regions'][region_index]
+        seed = account_index * 31 + stack_set['Index'] * 17 + region_index
+        if account['Status'] == 'SUSPENDED':
+            detailed_status, drift_status = 'SKIPPED_SUSPENDED_ACCOUNT', 'NOT_CHECKED'
+        else:
+            detailed_status = 'FAILED' if seed % 100 == 0 else 'SUCCEEDED'
+            drift_status = 'DRIFTED' if seed % 33 == 1 else 'IN_SYNC'
+        return {
+            'StackSetId': stack_set['StackSetId'],
+            'Region': region,
+            'Account': account['Id'],
+            'StackId': f"arn:aws:cloudformation:{region}:{account['Id']}:stack/StackSet-{stack_set['StackSetName']}-{uuid.UUID(int=seed)}/{uuid.UUID(int=seed + 1)}",
+            'Status': 'OUTDATED' if detailed_status != 'SUCCEEDED' else 'CURRENT',
+            'StackInstanceStatus': {'DetailedStatus': detailed_status},
+            'OrganizationalUnitId': self.get_parent_id(account_index),
+            'DriftStatus': drift_status,
+            'LastDriftCheckTimestamp': '2024-01-01T00:00:00Z',
+            'LastOperationId': f'{uuid.UUID(int=stack_set["Index"])}',
+        }
+
+
+class FakeAWSClient:
+    # 记录调用次数，注入延迟和限流；meta与Boto3客户端一致，使app按 (服务, 区域) 使用令牌桶
+    service_name = None
+
+    def __init__(self, fleet, region, stats, latency, throttle, tps):
+        self.fleet = fleet
+        self.meta = types.SimpleNamespace(region_name=region, service_model=types.SimpleNamespace(service_name=self.service_name))
+        self.stats = stats
+        self.latency = latency
+        self.throttle = throttle
+        self.tps = tps
+        self.window = []
+        self.lock = threading.Lock()
+
+    def _call(self, operation_name):
+        throttled = self.throttle and random.random() < self.throttle
+        if self.tps:
+            # 模拟服务端配额：最近一秒内的请求数超过tps时返回限流错误
+            with self.lock:
+                now = time.monotonic()
+                self.window = [t for t in self.window if now - t < 1]
+                throttled = throttled or len(self.window) >= self.tps
+                self.window.append(now)
+        self.stats.record(operation_name, throttled)
+        if self.latency:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if throttled:
+            raise ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, operation_name)
+
+    @staticmethod
+    def _page(items, next_token, page_size):
+        start = int(next_token or 0)
+        response = {'Items': items[start:start + page_size]}
+        if start + page_size < len(items):
+            response['NextToken'] = str(start + page_size)
+        return response
+
+
+class FakeOrganizations(FakeAWSClient):
+    service_name = 'organizations'
+
+    def list_accounts(self, NextToken=None, **kwargs):
+        self._call('ListAccounts')
+        page = self._page(self.fleet.accounts, NextToken, ACCOUNTS_PAGE_SIZE)
+        page['Accounts'] = page.pop('Items')
+        return page
+
+    def describe_account(self, AccountId, **kwargs):
+        self._call('DescribeAccount')
+        for account in self.fleet.accounts:
+            if account['Id'] == AccountId:
+                return {'Account': account}
+        raise ClientError({'Error': {'Code': 'AccountNotFoundException', 'Message': AccountId}}, 'DescribeAccount')
+
+    def list_roots(self, NextToken=None, **kwargs):
+        self._call('ListRoots')
+        return {'Roots': [{'Id': self.fleet.root_id, 'Name': 'Root'}]}
+
+    def list_organizational_units_for_parent(self, ParentId, NextToken=None, **kwargs):
+        self._call('ListOrganizationalUnitsForParent')
+        ous = [{'Id': ou_id, 'Name': ou_id} for ou_id in self.fleet.ou_ids] if ParentId == self.fleet.root_id else []
+        page = self._page(ous, NextToken, CHILDREN_PAGE_SIZE)
+        page['OrganizationalUnits'] = page.pop('Items')
+        return page
+
+    def list_children(self, ParentId, ChildType, NextToken=None, **kwargs):
+        self._call('ListChildren')
+        children = [{'Id': account['Id'], 'Type': 'ACCOUNT'} for i, account in enumerate(self.fleet.accounts)
+                    if self.fleet.get_parent_id(i) == ParentId]
+        page = self._page(children, NextToken, CHILDREN_PAGE_SIZE)
+        page['Children'] = page.pop('Items')
+        return page
+
+    def list_parents(self, ChildId, **kwargs):
+        self._call('ListParents')
+        account_index = int(ChildId) - 100000000000
+        return {'Parents': [{'Id': self.fleet.get_parent_id(account_index), 'Type': 'ORGANIZATIONAL_UNIT'}]}
+
+
+class FakeCloudFormation(FakeAWSClient):
+    service_name = 'cloudformation'
+    FILTER_FIELDS = {
+        'DETAILED_STATUS': lambda instance: instance['StackInstanceStatus']['DetailedStatus'],
+        'DRIFT_STATUS': lambda instance: instance['DriftStatus'],
+        'LAST_OPERATION_ID': lambda instance: instance['LastOperationId'],
+    }
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.operations = {}
+
+    def _stack_set(self, name):
+        for stack_set in self.fleet.stack_sets_in(self.meta.region_name):
+            if stack_set['StackSetName'] == name:
+                return stack_set
+        raise ClientError({'Error': {'Code': 'StackSetNotFoundException', 'Message': name}}, 'DescribeStackSet')
+
+    def list_stack_sets(self, NextToken=None, **kwargs):
+        self._call('ListStackSets')
+        summaries = [{'StackSetName': stack_set['StackSetName'], 'StackSetId': stack_set['StackSetId'], 'Status': 'ACTIVE',
+                      'PermissionModel': 'SERVICE_MANAGED'} for stack_set in self.fleet.stack_sets_in(self.meta.region_name)]
+        page = self._page(summaries, NextToken, STACK_SETS_PAGE_SIZE)
+        page['Summaries'] = page.pop('Items')
+        return page
+
+    def describe_stack_set(self, StackSetName, **kwargs):
+        self._call('DescribeStackSet')
+        stack_set = self._stack_set(StackSetName)
+        return {'StackSet': {
+            'StackSetName': StackSetName,
+            'StackSetId': stack_set['StackSetId'],
+            'Status': 'ACTIVE',
+            'PermissionModel': 'SERVICE_MANAGED',
+            'AutoDeployment': {'Enabled': True, 'RetainStacksOnAccountRemoval': False},
+            'Regions': stack_set['Regions'],
+            'OrganizationalUnitIds': self.fleet.ou_ids,
+        }}
+
+    def list_stack_instances(self, StackSetName, NextToken=None, MaxResults=None, Filters=None, **kwargs):
+        # 与服务端一致：Filters在服务端执行，分页按扫描位置继续
+        self._call('ListStackInstances')
+        stack_set = self._stack_set(StackSetName)
+        page_size = min(MaxResults or STACK_INSTANCES_PAGE_SIZE, STACK_INSTANCES_PAGE_SIZE)
+        total = self.fleet.instance_count(stack_set)
+        position = int(NextToken or 0)
+        summaries = []
+        while position < total and len(summaries) < page_size:
+            instance = self.fleet.instance(stack_set, position)
+            position += 1
+            if all(self.FILTER_FIELDS[f['Name']](instance) == f['Values'] for f in Filters or []):
+                summaries.append(instance)
+        response = {'Summaries': summaries}
+        if position < total:
+            response['NextToken'] = str(position)
+        return response
+
+    def _start_operation(self, operation_name, DeploymentTargets=None, Regions=None, OperationId=None, **kwargs):
+        # 记录操作目标，list_stack_set_operation_results对每个 (账户, 区域) 返回SUCCEEDED
+        self._call(operation_name)
+        operation_id = OperationId or str(uuid.uuid4())
+        targets = DeploymentTargets or {}
+        with self.lock:
+            self.operations[operation_id] = [{'Account': account, 'Region': region, 'Status': 'SUCCEEDED',
+                                              'OrganizationalUnitId': self.fleet.get_parent_id(int(account) - 100000000000)}
+                                             for account in targets.get('Accounts', []) for region in Regions or []]
+        return {'OperationId': operation_id}
+
+    def create_stack_instances(self, **kwargs):
+        return self._start_operation('CreateStackInstances', **kwargs)
+
+    def update_stack_instances(self, **kwargs):
+        return self._start_operation('UpdateStackInstances', **kwargs)
+
+    def delete_stack_instances(self, **kwargs):
+        return self._start_operation('DeleteStackInstances', **kwargs)
+
+    def detect_stack_set_drift(self, **kwargs):
+        return self._start_operation('DetectStackSetDrift', **kwargs)
+
+    def describe_stack_set_operation(self, StackSetName, OperationId, **kwargs):
+        self._call('DescribeStackSetOperation')
+        return {'StackSetOperation': {'OperationId': OperationId, 'StackSetId': self._stack_set(StackSetName)['StackSetId'],
+                                      'Action': 'UPDATE', 'Status': 'SUCCEEDED'}}
+
+    def list_stack_set_operation_results(self, OperationId, NextToken=None, MaxResults=None, **kwargs):
+        self._call('ListStackSetOperationResults')
+        page = self._page(self.operations.get(OperationId, []), NextToken, min(MaxResults or 100, 100))
+        page['Summaries'] = page.pop('Items')
+        return page
+
+
+class CallStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.throttled = 0
+
+    def record(self, operation_name, throttled):
+        with self.lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+            self.throttled += int(throttled)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.calls), self.throttled
+
+
+def build_scenarios(fleet):
+    # 以实例最多的StackSet作为单个StackSet端点的目标
+    target = max(fleet.stack_sets, key=fleet.instance_count)
+    body = {'stackSetName': target['StackSetName'], 'stackSetRegion': target['HomeRegion']}
+    return [
+        {'name': 'dashboard_cold', 'cold': True, 'method': 'GET', 'path': '/?stream=false'},
+        {'name': 'dashboard_warm', 'method': 'GET', 'path': '/?stream=false'},
+        {'name': 'dashboard_ndjson_warm', 'method': 'GET', 'path': '/?format=ndjson'},
+        {'name': 'failed_instances_cold', 'cold': True, 'method': 'POST', 'path': '/get_failed_instances', 'json': body},
+        {'name': 'drifted_instances_warm', 'method': 'POST', 'path': '/get_drifted_instances', 'json': body},
+        {'name': 'instances_api_warm', 'method': 'GET',
+         'path': f"/api/stacksets/{target['StackSetName']}/instances?stackSetRegion={target['HomeRegion']}&status=FAILED"},
+        {'name': 'not_deployed_accounts_warm', 'method': 'POST', 'path': '/get_not_deployed_accounts', 'json': body},
+        {'name': 'add_undeployed_dry_run_cold', 'cold': True, 'method': 'POST', 'path': '/add_undeployed_accounts',
+         'json': dict(body, dryRun=True)},
+        {'name': 'remove_suspended_dry_run_warm', 'method': 'POST', 'path': '/remove_suspended_accounts', 'json': dict(body, dryRun=True)},
+        {'name': 'retry_failed_dry_run_warm', 'method': 'POST', 'path': '/retry_failed_instances', 'json': dict(body, dryRun=True)},
+        # 在缓存已加载时重试失败实例并等待操作结束，再加载主页：测量操作后刷新缓存的开销
+        {'name': 'retry_failed_refresh_warm', 'fresh': True, 'action': ('retry_failed_instances', target['StackSetName'], target['HomeRegion']),
+         'method': 'GET', 'path': '/?stream=false'},
+    ]
+
+
+def clear_caches(app):
+    app.inventory_cache.clear()
+    app.stack_set_cache.clear()
+    app.account_directory_cache.clear()
+    app.organization_cache.clear()
+    app.stack_set_list_cache.clear()
+
+
+def send_request(client, scenario):
+    if scenario['method'] == 'GET':
+        return client.get(scenario['path'])
+    return client.post(scenario['path'], json=scenario.get('json'))
+
+
+def run_action(app, action, stack_set_name, stack_set_region):
+    _, targets = app.plan_stack_set_action(action, stack_set_name, stack_set_region, set())
+    app.run_stack_set_action(action, stack_set_name, stack_set_region, targets, app.get_operation_preferences())
+
+
+def run_scenario(app, client, stats, scenario, trace_memory):
+    # cold场景先清空缓存；fresh场景清空缓存后加载主页，使每次运行的操作目标相同；
+    # 其他场景先加载主页并发送一次不计时的请求，确保测量的是缓存命中的情况
+    if scenario.get('cold'):
+        clear_caches(app)
+    elif scenario.get('fresh'):
+        clear_caches(app)
+        client.get('/?stream=false')
+    else:
+        client.get('/?stream=false')
+        send_request(client, scenario)
+    stats.reset()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    if scenario.get('action'):
+        run_action(app, *scenario['action'])
+    response = send_request(client, scenario)
+    response_bytes = len(response.get_data())
+    wall_time = time.perf_counter() - started
+    peak_memory = 0
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    calls, throttled = stats.snapshot()
+    if response.status_code >= 400:
+        raise RuntimeError(f"{scenario['name']}: HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return {
+        'wall_time': round(wall_time, 4),
+        'aws_calls': sum(calls.values()),
+        'throttled_calls': throttled,
+        'calls_by_operation': calls,
+        'peak_memory': peak_memory,
+        'response_bytes': response_bytes,
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance, time_tolerance):
+    # 调用次数、内存和响应大小基本确定，使用较严格的容差；墙钟时间波动较大，单独设置容差
+    regressions = []
+    for name, result in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric, allowed in (('aws_calls', tolerance), ('peak_memory', tolerance), ('response_bytes', tolerance),
+                                ('wall_time', time_tolerance)):
+            limit = previous[metric] * (1 + allowed) + (0.05 if metric == 'wall_time' else 0)
+            if result[metric] > limit:
+                regressions.append(f"{name}.{metric}: {result[metric]} > {previous[metric]} (+{allowed:.0%})")
+    return regressions
+
+
+def iter_instances(fleet, count):
+    # 依次遍历所有StackSet的实例，直到数量达到count
+    produced = 0
+    for stack_set in fleet.stack_sets:
+        for position in range(fleet.instance_count(stack_set)):
+            if produced == count:
+                return
+            yield fleet.instance(stack_set, position)
+            produced += 1
+
+
+def measure_index_memory(app, fleet, count, raw_sample):
+    # 原始boto3字典按raw_sample个实例实测后按比例换算；InstanceIndex按完整数量实测
+    total = sum(fleet.instance_count(stack_set) for stack_set in fleet.stack_sets)
+    if total < count:
+        raise SystemExit(f'the fleet has only {total} instances; use a larger preset or more --accounts')
+    raw_sample = min(raw_sample, count)
+    tracemalloc.start()
+    raw = list(iter_instances(fleet, raw_sample))
+    raw_bytes = tracemalloc.get_traced_memory()[0] * count // raw_sample
+    del raw
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = app.InstanceIndex(app.instance_record(instance) for instance in iter_instances(fleet, count))
+    build_time = time.perf_counter() - started
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {
+        'instances': len(index),
+        'raw_bytes': raw_bytes,
+        'raw_sample': raw_sample,
+        'index_bytes': index_bytes,
+        'estimated_bytes': app.estimate_size(index),
+        'build_time': round(build_time, 3),
+    }
+
+
+def print_index_memory(result):
+    count = result['instances']
+    print(f"cached instance memory, {count} instances:")
+    print(f"  raw boto3 dicts  {result['raw_bytes'] / 1048576:>9.1f} MB {result['raw_bytes'] / count:>8.0f} B/instance "
+          f"(measured on {result['raw_sample']})")
+    print(f"  InstanceIndex    {result['index_bytes'] / 1048576:>9.1f} MB {result['index_bytes'] / count:>8.0f} B/instance "
+          f"(cache estimate {result['estimated_bytes'] / 1048576:.1f} MB, built in {result['build_time']:.1f}s)")
+    print(f"  reduction        {result['raw_bytes'] / result['index_bytes']:>9.1f}x")
+
+
+def print_report(results):
+    print(f"fleet: {results['fleet']}")
+    print(f"{'scenario':<32} {'wall s':>9} {'calls':>8} {'throttled':>9} {'peak MB':>9} {'resp KB':>9}")
+    for name, result in results['scenarios'].items():
+        print(f"{name:<32} {result['wall_time']:>9.3f} {result['aws_calls']:>8} {result['throttled_calls']:>9} "
+              f"{result['peak_memory'] / 1048576:>9.1f} {result['response_bytes'] / 1024:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark with a synthetic CloudFormation/Organizations fleet.')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--accounts', type=int, help='number of accounts (overrides preset)')
+    parser.add_argument('--stack-sets', type=int, help='number of StackSets (overrides preset)')
+    parser.add_argument('--regions', type=int, help='number of deployment regions (overrides preset)')
+    parser.add_argument('--home-regions', type=int, help='number of StackSet home regions (overrides preset)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='mean latency injected into every AWS call')
+    parser.add_argument('--throttle', type=float, default=0, help='probability that an AWS call is throttled')
+    parser.add_argument('--tps', type=int, default=0, help='per service and region request quota; excess calls are throttled')
+    parser.add_argument('--scenarios', help='comma-separated scenario names to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per scenario; the fastest run is reported')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, which slows down large fleets')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--save-baseline', help='write results as a baseline file')
+    parser.add_argument('--baseline', help='compare with a baseline file and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed growth of calls, memory and response size')
+    parser.add_argument('--time-tolerance', type=float, default=0.5, help='allowed growth of wall time')
+    parser.add_argument('--index-memory', type=int, metavar='N',
+                        help='instead of the endpoints, measure the memory of N cached instances')
+    parser.add_argument('--raw-sample', type=int, default=100000, help='raw boto3 instances measured for --index-memory')
+    parser.add_argument('--verbose', action='store_true', help='keep the application INFO logs')
+    args = parser.parse_args(argv)
+
+    size = dict(PRESETS[args.preset])
+    for key in size:
+        if getattr(args, key) is not None:
+            size[key] = getattr(args, key)
+    random.seed(0)
+    fleet = SyntheticFleet(**size)
+
+    # 在导入app之前配置环境，使用本地假客户端且不写快照
+    os.environ.setdefault('AWS_DEFAULT_REGION', fleet.home_regions[0])
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('STACKSET_REGIONS', ','.join(fleet.home_regions))
+    os.environ.setdefault('SNAPSHOT_DB_PATH', '')
+    os.environ.setdefault('AWS_API_RATE_LIMIT', '1000')
+    os.environ.setdefault('OPERATION_POLL_INTERVAL', '0')
+    import app
+    if not args.verbose:
+        app.logger.setLevel(logging.WARNING)
+
+    stats = CallStats()
+    latency = args.latency_ms / 1000
+    for region in fleet.home_regions:
+        app.client_pool.clients[('cloudformation', region)] = FakeCloudFormation(fleet, region, stats, latency, args.throttle, args.tps)
+    app.client_pool.clients[('organizations', app.aws_region)] = FakeOrganizations(fleet, app.aws_region, stats, latency,
+                                                                                    args.throttle, args.tps)
+
+    if args.index_memory:
+        result = measure_index_memory(app, fleet, args.index_memory, args.raw_sample)
+        print_index_memory(result)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'fleet': size, 'index_memory': result}, f, indent=2, sort_keys=True)
+        return 0
+
+    scenarios = build_scenarios(fleet)
+    if args.scenarios:
+        selected = set(args.scenarios.split(','))
+        scenarios = [scenario for scenario in scenarios if scenario['name'] in selected]
+
+    client = app.app.test_client()
+    results = {'fleet': dict(size, instances=sum(fleet.instance_count(stack_set) for stack_set in fleet.stack_sets),
+                             latency_ms=args.latency_ms, throttle=args.throttle, tps=args.tps),
+               'scenarios': {}}
+    for scenario in scenarios:
+        runs = [run_scenario(app, client, stats, scenario, not args.no_memory) for _ in range(args.repeat)]
+        results['scenarios'][scenario['name']] = min(runs, key=lambda run: run['wall_time'])
+
+    print_report(results)
+    for path in filter(None, (args.json, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance, args.time_tolerance)
+        if regressions:
+            print('Regressions:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print('No regressions against baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""Headless batch mode for cfn-stackset-powertools.
+
+Runs the dashboard actions over many StackSets without the web server and
+writes one JSON record per StackSet as soon as it is done:
+
+    python cli.py retry-failed --all --dry-run
+    python cli.py add-undeployed --pattern 'org-baseline-*' --ignore-accounts 111111111111 --output run.ndjson
+    python cli.py remove-suspended --all --output run.ndjson --resume run.ndjson
+    python cli.py export --all --format csv --gzip --output instances.csv.gz
+"""
+import argparse
+import datetime
+import fnmatch
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import app
+
+ACTIONS = {
+    'add-undeployed': 'add_undeployed_accounts',
+    'remove-suspended': 'remove_suspended_accounts',
+    'retry-failed': 'retry_failed_instances',
+    'retry-drifted': 'retry_drifted_instances',
+    'detect-drift': 'detect_drift',
+}
+
+# 续跑时跳过的状态；干运行的结果只在再次干运行时跳过
+COMPLETED_STATUSES = {'SUCCEEDED', 'NOTHING_TO_DO'}
+
+
+def read_ignore_accounts(args):
+    accounts = {account.strip() for value in args.ignore_accounts for account in value.split(',') if account.strip()}
+    for path in args.ignore_accounts_file:
+        with open(path) as f:
+            accounts.update(line.split('#')[0].strip() for line in f if line.split('#')[0].strip())
+    return accounts
+
+
+def select_stack_sets(args):
+    # 列出所有主区域中的StackSet，按名称、模式和排除模式筛选
+    regions = set(args.region) if args.region else None
+    stack_set_keys = [(region, name) for region, name in app.list_all_stack_sets() if regions is None or region in regions]
+    if not args.all:
+        patterns = args.pattern + args.stack_set
+        stack_set_keys = [(region, name) for region, name in stack_set_keys
+                          if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+    return [(region, name) for region, name in stack_set_keys
+            if not any(fnmatch.fnmatchcase(name, pattern) for pattern in args.exclude)]
+
+
+def read_completed(path, action, dry_run):
+    # 从上次的NDJSON结果中找出已完成的StackSet
+    completed = set()
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('action') != action:
+                    continue
+                if record.get('status') in COMPLETED_STATUSES or (dry_run and record.get('status') == 'DRY_RUN'):
+                    completed.add((record.get('stackSetRegion'), record.get('stackSetName')))
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+def process_stack_set(action, stack_set_region, stack_set_name, ignore_accounts, dry_run, operation_preferences):
+    record = {
+        'action': action,
+        'stackSetName': stack_set_name,
+        'stackSetRegion': stack_set_region,
+        'dryRun': dry_run,
+        'startedAt': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    started_at = time.monotonic()
+    try:
+        if action == 'detect_drift':
+            record['count'] = 1
+            if dry_run:
+                record['status'] = 'DRY_RUN'
+            else:
+                operation = app.detect_stack_set_drift(stack_set_name, stack_set_region, operation_preferences)
+                record['operationIds'] = [operation['OperationId']]
+                record['driftDetectionDetails'] = operation.get('StackSetDriftDetectionDetails', {})
+                record['status'] = 'SUCCEEDED' if operation['Status'] == 'SUCCEEDED' else 'FAILED'
+        else:
+            items, targets = app.plan_stack_set_action(action, stack_set_name, stack_set_region, ignore_accounts)
+            record['count'] = len(items)
+            record['items'] = items
+            if not items:
+                record['status'] = 'NOTHING_TO_DO'
+            elif dry_run:
+                record['status'] = 'DRY_RUN'
+            else:
+                record.update(app.run_stack_set_action(action, stack_set_name, stack_set_region, targets, operation_preferences))
+                record['status'] = 'SUCCEEDED'
+    except Exception as e:
+        app.logger.error(f"StackSet {stack_set_name} ({stack_set_region}) {action} 失败: {str(e)}", exc_info=True)
+        record['status'] = 'FAILED'
+        record['error'] = str(e)
+    record['finishedAt'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    record['durationSeconds'] = round(time.monotonic() - started_at, 3)
+    return record
+
+
+def export_instances(args, stack_set_keys):
+    # 导出与Web端 /export 共用同一个生成器，逐块写入文件或标准输出；获取失败的StackSet跳过，最后以非零状态退出
+    filters = {field: getattr(args, field).split(',') for field in ('status', 'drift') if getattr(args, field)}
+    errors = []
+    try:
+        chunks = app.iter_export(args.format, stack_set_keys, filters, args.gzip, errors=errors)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    written = 0
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+        output.flush()
+    finally:
+        if args.output:
+            output.close()
+    print(f"Exported {len(stack_set_keys) - len(errors)} StackSets, {written} bytes", file=sys.stderr)
+    for error in errors:
+        print(f"Error: {error['StackSetName']} ({error['StackSetRegion']}) was not exported: {error['Error']}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run StackSet actions over many StackSets and write NDJSON results, or export their instances.')
+    parser.add_argument('action', choices=sorted([*ACTIONS, 'export']))
+    parser.add_argument('--all', action='store_true', help='all StackSets in every home region')
+    parser.add_argument('--pattern', action='append', default=[], help='StackSet name glob pattern; can be repeated')
+    parser.add_argument('--stack-set', action='append', default=[], help='StackSet name; can be repeated')
+    parser.add_argument('--exclude', action='append', default=[], help='StackSet name glob pattern to skip; can be repeated')
+    parser.add_argument('--region', action='append', default=[], help='only StackSets in this home region; can be repeated')
+    parser.add_argument('--ignore-accounts', action='append', default=[], help='comma-separated account IDs to leave untouched')
+    parser.add_argument('--ignore-accounts-file', action='append', default=[], help='file with one account ID per line')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would change')
+    parser.add_argument('--concurrency', type=int, default=app.max_workers, help='StackSets processed at the same time')
+    parser.add_argument('--operation-preferences', type=json.loads, help='JSON object overriding the operation preferences')
+    parser.add_argument('--output', help='write to this file instead of stdout; action results are appended')
+    parser.add_argument('--resume', help='skip StackSets that already completed in this NDJSON file')
+    parser.add_argument('--format', choices=sorted(app.EXPORT_FORMATS), default='csv', help='export: output format')
+    parser.add_argument('--gzip', action='store_true', help='export: compress the output')
+    parser.add_argument('--status', help='export: comma-separated DetailedStatus values')
+    parser.add_argument('--drift', help='export: comma-separated DriftStatus values')
+    parser.add_argument('--log-level', default='WARNING', help='application log level')
+    args = parser.parse_args(argv)
+    if args.all == bool(args.pattern or args.stack_set):
+        parser.error('use either --all or --pattern/--stack-set')
+
+    app.logger.setLevel(args.log_level.upper())
+    stack_set_keys = select_stack_sets(args)
+    if args.action == 'export':
+        return export_instances(args, stack_set_keys)
+
+    action = ACTIONS[args.action]
+    ignore_accounts = read_ignore_accounts(args)
+    operation_preferences = app.get_operation_preferences(args.operation_preferences)
+    if args.resume:
+        completed = read_completed(args.resume, action, args.dry_run)
+        stack_set_keys = [key for key in stack_set_keys if key not in completed]
+        print(f"Resuming: {len(completed)} StackSets already completed", file=sys.stderr)
+    print(f"{args.action}: {len(stack_set_keys)} StackSets, concurrency {args.concurrency}, dry run: {args.dry_run}", file=sys.stderr)
+
+    output = open(args.output, 'a') if args.output else sys.stdout
+    output_lock = threading.Lock()
+    summary = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix='cli') as executor:
+            futures = [executor.submit(process_stack_set, action, stack_set_region, stack_set_name, ignore_accounts,
+                                       args.dry_run, operation_preferences)
+                       for stack_set_region, stack_set_name in stack_set_keys]
+            for future in as_completed(futures):
+                record = future.result()
+                summary[record['status']] = summary.get(record['status'], 0) + 1
+                with output_lock:
+                    output.write(json.dumps(record, default=str) + '\n')
+                    output.flush()
+    finally:
+        if args.output:
+            output.close()
+
+    print(f"Done: {summary}", file=sys.stderr)
+    return 1 if summary.get('FAILED') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import app  # noqa: E402
+
+REGIONS = ['us-east-1', 'eu-west-1', 'ap-northeast-1', 'us-west-2']
+STATUSES = ['SUCCEEDED', 'FAILED', 'CANCELLED', 'INOPERABLE', 'SKIPPED_SUSPENDED_ACCOUNT']
+DRIFT_STATUSES = ['IN_SYNC', 'DRIFTED', 'NOT_CHECKED']
+
+
+def make_record(rng, account, region):
+    return {
+        'Account': str(100000000000 + account),
+        'Region': region,
+        'OrganizationalUnitId': f'ou-{account % 3}',
+        'DetailedStatus': rng.choice(STATUSES),
+        'DriftStatus': rng.choice(DRIFT_STATUSES),
+    }
+
+
+def record_key(record):
+    return tuple(record[name] for name in app.InstanceIndex.FIELDS.values())
+
+
+def snapshot(index):
+    # 位置因删除时的移动而不同，比较记录、每个位置数组对应的记录、计数和账户区域集合
+    buckets = {field: {value: sorted(record_key(index.record(position)) for position in positions)
+                       for value, positions in field_buckets.items()}
+               for field, field_buckets in index.buckets.items()}
+    return {
+        'records': sorted(record_key(record) for record in index.records()),
+        'buckets': buckets,
+        'counts': {field: dict(counts) for field, counts in index.counts.items()},
+        'account_regions': dict(index.account_regions),
+    }
+
+
+def test_with_changes_matches_rebuilt_index():
+    rng = random.Random(20)
+    records = {(record['Account'], record['Region']): record
+               for record in (make_record(rng, account, region) for account in range(60) for region in REGIONS)
+               if rng.random() < 0.8}
+    index = app.InstanceIndex(records.values())
+    for _ in range(300):
+        changes = {}
+        for _ in range(rng.randint(1, 8)):
+            account, region = rng.randint(0, 70), rng.choice(REGIONS + ['sa-east-1'])
+            record = make_record(rng, account, region)
+            changes[(record['Account'], record['Region'])] = None if rng.random() < 0.4 else record
+        before = snapshot(index)
+        patched = index.with_changes(changes)
+        # 原索引保持不变（可能仍有请求在读取）
+        assert snapshot(index) == before
+        for key, record in changes.items():
+            if record is None:
+                records.pop(key, None)
+            else:
+                records[key] = record
+        rebuilt = app.InstanceIndex(records.values())
+        actual, expected = snapshot(patched), snapshot(rebuilt)
+        for part in expected:
+            assert actual[part] == expected[part], part
+        for field_buckets in patched.buckets.values():
+            for positions in field_buckets.values():
+                assert list(positions) == sorted(positions)
+        for key, record in records.items():
+            assert patched.get(*key) == record
+        assert patched.scanned_at == index.scanned_at
+        index = patched
+
+
+def test_query_after_changes():
+    rng = random.Random(7)
+    records = [make_record(rng, account, region) for account in range(30) for region in REGIONS]
+    index = app.InstanceIndex(records)
+    failed = [record for record in records if record['DetailedStatus'] == 'FAILED']
+    changes = {(record['Account'], record['Region']): dict(record, DetailedStatus='SUCCEEDED') for record in failed[:5]}
+    patched = index.with_changes(changes)
+    expected = sorted(record_key(record) for record in failed[5:] if record['Region'] == 'us-east-1')
+    actual = sorted(record_key(record) for record in patched.query(status=['FAILED'], region=['us-east-1']))
+    assert actual == expected
+
+
+def test_plan_operation_changes():
+    record = {'Account': '1', 'Region': 'us-east-1', 'OrganizationalUnitId': 'ou-1', 'DetailedStatus': 'FAILED', 'DriftStatus': 'DRIFTED'}
+    index = app.InstanceIndex([record])
+    succeeded = [{'Account': '1', 'Region': 'us-east-1', 'Status': 'SUCCEEDED'}]
+    assert app.plan_operation_changes(index, 'update_stack_instances', succeeded, 1) == {
+        ('1', 'us-east-1'): dict(record, DetailedStatus='SUCCEEDED', DriftStatus='NOT_CHECKED')}
+    assert app.plan_operation_changes(index, 'delete_stack_instances', succeeded, 1) == {('1', 'us-east-1'): None}
+    # 结果未完成、数量不符或与索引不一致时交由全量重新扫描
+    assert app.plan_operation_changes(index, 'update_stack_instances', [dict(succeeded[0], Status='RUNNING')], 1) is None
+    assert app.plan_operation_changes(index, 'update_stack_instances', succeeded, 2) is None
+    assert app.plan_operation_changes(index, 'update_stack_instances', [dict(succeeded[0], Account='2')], 1) is None
+    created = [{'Account': '2', 'Region': 'eu-west-1', 'Status': 'FAILED', 'OrganizationalUnitId': 'ou-2'}]
+    assert app.plan_operation_changes(index, 'create_stack_instances', created, 1) == {('2', 'eu-west-1'): {
+        'Account': '2', 'Region': 'eu-west-1', 'OrganizationalUnitId': 'ou-2', 'DetailedStatus': 'FAILED', 'DriftStatus': 'NOT_CHECKED'}}